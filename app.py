@@ -1,15 +1,67 @@
 from recipe_app import RecipeApp
+from query_planner import RecipeQuery
+from nutrition_index import MacroQuery
+from review_index import ReviewQuery
+try:
+    import readline
+except ImportError:  # readline is unavailable on some platforms (e.g. Windows)
+    readline = None
 from formatters import (
     format_recipe_output,
     format_sentiment_output,
     format_trend_output,
-    format_nutrition_analysis
+    format_nutrition_analysis,
+    format_percentile_output,
+    format_distinct_output,
+    format_heavy_hitters_output,
+    format_degradation_output,
+    format_faceted_output,
+    format_review_search_output,
+    OUTPUT_MODES
 )
 
+COMMANDS = ['search', 'find', 'time', 'cuisine', 'nutrition', 'analyze_nutrition', 'similar',
+            'pantry', 'macros', 'recommend', 'rate', 'top', 'trends', 'sentiment', 'reviews', 'diet', 'percentile', 'reviewers',
+            'top_ingredients', 'deadlines', 'help', 'exit']
+
+# Commands whose argument is a recipe name and/or ingredient list
+COMPLETION_KINDS = {'search': 'all', 'similar': 'names', 'sentiment': 'names', 'pantry': 'ingredients'}
+# Commands taking a comma-separated list; only the item after the last comma is completed
+LIST_COMMANDS = {'pantry'}
+
 class RecipeCLI:
     def __init__(self):
         self.app = RecipeApp()
-        
+        self._completions = []
+        self._setup_completion()
+
+    def _setup_completion(self):
+        """Enable tab completion of commands, recipe names and ingredients"""
+        if readline is None:
+            return
+        # Complete against the whole line so multi-word recipe names work
+        readline.set_completer_delims('')
+        readline.set_completer(self._complete)
+        readline.parse_and_bind('tab: complete')
+
+    def _complete(self, text, state):
+        if state == 0:
+            self._completions = self._completion_candidates(text)
+        return self._completions[state] if state < len(self._completions) else None
+
+    def _completion_candidates(self, line):
+        if ' ' not in line:
+            return [c for c in COMMANDS if c.startswith(line)]
+        command, _, arg = line.partition(' ')
+        kind = COMPLETION_KINDS.get(command)
+        head = ''
+        if command in LIST_COMMANDS and ',' in arg:
+            earlier, _, arg = arg.rpartition(',')
+            head = f"{earlier.rstrip()}, "
+        if kind is None or not arg.strip():
+            return []
+        return [f"{command} {head}{completion}" for completion in self.app.complete(arg.strip(), kind)]
+
     def print_help(self):
         """Print available commands and their usage"""
         print("\nAvailable commands:")
@@ -17,24 +69,45 @@ class RecipeCLI:
         print("1. search <ingredient/recipe name> - Search recipes by name or ingredients")
         print("2. time <minutes> - Find recipes taking less than specified minutes")
         print("3. cuisine <type> - Search recipes by cuisine type")
+        print("   find [text] [time<=N] [<nutrient><=N|>=N] [cuisine=X] [diet=X] [rating>=N] [--explain]")
+        print("      - Combine any of the criteria above in one query")
 
         print("\nNutritional Queries:")
-        print("4. nutrition <nutrient> <max_value> - Find recipes by nutritional criteria")
+        print("4. nutrition <nutrient> <max_value|pN> - Find recipes by nutritional criteria (p25 = 25th percentile)")
         print("5. analyze_nutrition [user_id] - Analyze nutritional patterns")
+        print("   macros [<nutrient>=<value|low|high>[*weight] ...] [<nutrient><=N|>=N ...] [rating>=N]")
+        print("      - Recipes closest to nutrition targets, e.g. macros calories=600 protein=80*2 sodium=low")
+        print("      - With only ranges, the best-rated matches, e.g. macros sodium<=20 protein>=30")
+        print("        (calories in kcal, other nutrients in % daily value)")
 
         print("\nRecommendations and Similar Recipes:")
-        print("6. similar <recipe_id> - Find similar recipes")
+        print("6. similar <recipe_id/recipe name> - Find similar recipes")
         print("7. recommend <user_id> - Get personalized recommendations")
+        print("   rate <user_id> <recipe_id> <1-5> [review text] - Rate a recipe and update your taste profile")
+        print("   pantry <ingredient>, <ingredient>, ... [--missing N] - Recipes you can make with what you have")
 
         print("\nAnalysis:")
+        print("   top [tag] - Top-rated recipes, adjusted for review count")
         print("8. trends [days=30] - Analyze recipe trends")
         print("9. sentiment <recipe_name> - Detailed sentiment analysis")
+        print("   reviews <words|\"phrase\"> [rating<=N|>=N] [date>=YYYY[-MM[-DD]]] [date<=...]")
+        print("      - Reviews mentioning something, e.g. reviews \"too salty\" rating<=2 date>=2015")
         print("10. diet <restriction> - Find recipes by dietary restriction")
 
+        print("\nApproximate Analytics (precomputed sketches):")
+        print("   percentile <nutrient> <0-100> [min_rating] - Nutrient percentile, e.g. percentile sodium 50 4.5")
+        print("   reviewers <recipe_id|YYYY-MM> - Distinct reviewers for a recipe or month")
+        print("   top_ingredients - Most common ingredients")
+        print("   deadlines - How often each command fell back to an approximate answer")
+
         print("\nOther Commands:")
         print("11. help - Show this help message")
         print("12. exit - Exit the application")
         print("\nAdd --limit N to any command to change number of results (default: 5)")
+        print("Add --output jsonl|csv to any command for machine-readable output")
+        print("Add --facets to search, cuisine or diet for time, calorie, rating and tag breakdowns")
+        print(f"Add --deadline S to any command to change its time budget (default: {self.app.default_deadline:g}s, 0 = none)")
+        print("Press Tab to complete commands, recipe names and ingredients")
 
     def run(self):
         """Main CLI loop"""
@@ -61,59 +134,175 @@ class RecipeCLI:
                         limit = int(command[limit_index + 1])
                         command = command[:limit_index] + command[limit_index + 2:]
 
+                # Handle output mode parameter
+                output = 'text'
+                if '--output' in command:
+                    output_index = command.index('--output')
+                    if len(command) > output_index + 1:
+                        output = command[output_index + 1].lower()
+                    command = command[:output_index] + command[output_index + 2:]
+                    if output not in OUTPUT_MODES:
+                        print(f"Error: Output mode must be one of {', '.join(OUTPUT_MODES)}")
+                        continue
+                self.app.stream_results = output != 'text'
+
+                # Handle deadline parameter (seconds; applies to every database call of the command)
+                deadline = None
+                if '--deadline' in command:
+                    deadline_index = command.index('--deadline')
+                    if len(command) > deadline_index + 1:
+                        deadline = float(command[deadline_index + 1])
+                    command = command[:deadline_index] + command[deadline_index + 2:]
+
+                facets = '--facets' in command
+                command = [c for c in command if c != '--facets']
+                if facets and command[0] in ('search', 'cuisine', 'diet') and len(command) > 1:
+                    term = ' '.join(command[1:])
+                    results = self.app.faceted_search(command[0], term, limit, deadline=deadline)
+                    format_faceted_output(results, f"{command[0]} '{term}'", output=output)
+                    continue
+
                 # Process commands
                 if command[0] == 'search' and len(command) > 1:
-                    results = self.app.search_recipes(' '.join(command[1:]), limit)
-                    format_recipe_output(results, f"search term '{' '.join(command[1:])}'")
+                    results = self.app.search_recipes(' '.join(command[1:]), limit, deadline=deadline)
+                    format_recipe_output(results, f"search term '{' '.join(command[1:])}'", output=output)
                 
+                elif command[0] == 'find' and len(command) > 1:
+                    explain = '--explain' in command
+                    args = [c for c in command[1:] if c != '--explain']
+                    try:
+                        query = RecipeQuery.parse(args)
+                    except ValueError as e:
+                        print(f"Error: {e}")
+                        continue
+                    if explain:
+                        print("\nQuery plan (most selective first):")
+                        for step in self.app.explain_query(query, deadline=deadline):
+                            marker = " <- drives scan" if step["driver"] else ""
+                            print(f"  {step['predicate']}: ~{step['selectivity']:.2%} "
+                                  f"(index: {step['index'] or 'none'}){marker}")
+                    results = self.app.find_recipes(query, limit, deadline=deadline)
+                    format_recipe_output(results, f"query '{' '.join(args)}'", output=output)
+
                 elif command[0] == 'time' and len(command) > 1:
                     if command[1].isdigit():
-                        results = self.app.find_by_cooking_time(int(command[1]), limit)
-                        format_recipe_output(results, f"cooking time <= {command[1]} minutes")
+                        results = self.app.find_by_cooking_time(int(command[1]), limit, deadline=deadline)
+                        format_recipe_output(results, f"cooking time <= {command[1]} minutes", output=output)
                     else:
                         print("Error: Cooking time must be a number")
                 
                 elif command[0] == 'cuisine' and len(command) > 1:
-                    results = self.app.find_by_cuisine(command[1], limit)
-                    format_recipe_output(results, f"cuisine type: {command[1]}")
+                    results = self.app.find_by_cuisine(command[1], limit, deadline=deadline)
+                    format_recipe_output(results, f"cuisine type: {command[1]}", output=output)
                 
                 elif command[0] == 'nutrition' and len(command) > 2:
                     try:
-                        value = float(command[2])
-                        results = self.app.find_by_nutrition(command[1], value, limit)
-                        format_recipe_output(results, f"{command[1]} <= {value}")
+                        if command[2].lower().startswith('p'):
+                            percentile = float(command[2][1:])
+                            results = self.app.find_by_nutrition(command[1], None, limit, percentile=percentile, deadline=deadline)
+                            format_recipe_output(results, f"{command[1]} <= {percentile:g}th percentile", output=output)
+                        else:
+                            value = float(command[2])
+                            results = self.app.find_by_nutrition(command[1], value, limit, deadline=deadline)
+                            format_recipe_output(results, f"{command[1]} <= {value}", output=output)
                     except ValueError:
-                        print("Error: Nutritional value must be a number")
+                        print("Error: Nutritional value must be a number or a percentile like p25")
+
+                elif command[0] == 'percentile' and len(command) > 2:
+                    try:
+                        min_rating = float(command[3]) if len(command) > 3 else 0.0
+                        format_percentile_output(
+                            self.app.nutrient_percentile(command[1], float(command[2]), min_rating, deadline=deadline), output=output)
+                    except ValueError as e:
+                        print(f"Error: {e}")
+
+                elif command[0] == 'reviewers' and len(command) > 1:
+                    if command[1].isdigit():
+                        format_distinct_output(self.app.distinct_reviewers(command[1], deadline=deadline), output=output)
+                    else:
+                        format_distinct_output(self.app.distinct_reviewers_by_month(command[1], deadline=deadline), output=output)
+
+                elif command[0] == 'deadlines':
+                    format_degradation_output(self.app.degradation_stats(), output=output)
+
+                elif command[0] == 'top_ingredients':
+                    format_heavy_hitters_output(self.app.top_ingredients(limit, deadline=deadline), output=output)
                 
                 elif command[0] == 'analyze_nutrition':
                     user_id = command[1] if len(command) > 1 else None
-                    results = self.app.analyze_nutritional_patterns(user_id)
+                    results = self.app.analyze_nutritional_patterns(user_id, deadline=deadline)
                     if results["overall_stats"] is None:
                         print("\nNo nutritional data available.")
                     else:
-                        format_nutrition_analysis(results)
+                        format_nutrition_analysis(results, output=output)
                 
                 elif command[0] == 'similar' and len(command) > 1:
-                    results = self.app.find_similar_recipes(command[1], limit)
-                    format_recipe_output(results, f"similar to recipe {command[1]}")
+                    recipe = ' '.join(command[1:])
+                    results = self.app.find_similar_recipes(recipe, limit, deadline=deadline)
+                    format_recipe_output(results, f"similar to recipe {recipe}", output=output)
                 
+                elif command[0] == 'macros' and len(command) > 1:
+                    try:
+                        query = MacroQuery.parse(command[1:])
+                    except ValueError as e:
+                        print(f"Error: {e}")
+                        continue
+                    results = self.app.find_by_macros(query, limit, deadline=deadline)
+                    format_recipe_output(results, f"nutrition targets {' '.join(command[1:])}", output=output)
+
+                elif command[0] == 'pantry' and len(command) > 1:
+                    max_missing = 0
+                    if '--missing' in command:
+                        missing_index = command.index('--missing')
+                        if len(command) > missing_index + 1 and command[missing_index + 1].isdigit():
+                            max_missing = int(command[missing_index + 1])
+                        command = command[:missing_index] + command[missing_index + 2:]
+                    ingredients = [i.strip() for i in ' '.join(command[1:]).split(',') if i.strip()]
+                    results = self.app.find_by_pantry(ingredients, max_missing, limit, deadline=deadline)
+                    format_recipe_output(results, f"pantry with {max_missing} missing ingredient(s) allowed", output=output)
+
                 elif command[0] == 'recommend' and len(command) > 1:
-                    results = self.app.get_personalized_recommendations(command[1], limit)
-                    format_recipe_output(results, f"recommendations for user {command[1]}")
+                    results = self.app.get_personalized_recommendations(command[1], limit, deadline=deadline)
+                    format_recipe_output(results, f"recommendations for user {command[1]}", output=output)
                 
+                elif command[0] == 'rate' and len(command) > 3:
+                    if not (command[1].isdigit() and command[2].isdigit() and command[3] in ('1', '2', '3', '4', '5')):
+                        print("Error: Usage is rate <user_id> <recipe_id> <1-5> [review text]")
+                        continue
+                    review = ' '.join(command[4:]) or None
+                    result = self.app.rate_recipe(command[1], command[2], int(command[3]), review, deadline=deadline)
+                    if result is None:
+                        print(f"No recipe found with ID {command[2]}")
+                    else:
+                        print(f"\nRated {result['recipe_name']}: {result['rating']} ★")
+
+                elif command[0] == 'top':
+                    tag = ' '.join(command[1:]) or None
+                    results = self.app.find_top_rated(limit, tag, deadline=deadline)
+                    format_recipe_output(results, f"top rated{f' for tag {tag}' if tag else ''}", output=output)
+
                 elif command[0] == 'trends':
                     days = int(command[1]) if len(command) > 1 and command[1].isdigit() else 30
-                    results = self.app.analyze_trends(days)
-                    format_trend_output(results)
+                    results = self.app.analyze_trends(days, deadline=deadline)
+                    format_trend_output(results, output=output)
                 
                 elif command[0] == 'sentiment' and len(command) > 1:
-                    results = self.app.analyze_sentiment_detailed(' '.join(command[1:]))
-                    format_sentiment_output(results)
+                    results = self.app.analyze_sentiment_detailed(' '.join(command[1:]), deadline=deadline)
+                    format_sentiment_output(results, output=output)
                 
+                elif command[0] == 'reviews' and len(command) > 1:
+                    try:
+                        query = ReviewQuery.parse(command[1:])
+                    except ValueError as e:
+                        print(f"Error: {e}")
+                        continue
+                    results = self.app.search_reviews(query, limit, deadline=deadline)
+                    format_review_search_output(results, f"'{' '.join(command[1:])}'", output=output)
+
                 elif command[0] == 'diet' and len(command) > 1:
                     diet_restriction = command[1].lower()
-                    results = self.app.find_by_diet(diet_restriction, limit)
-                    format_recipe_output(results, f"dietary restriction: {diet_restriction}")
+                    results = self.app.find_by_diet(diet_restriction, limit, deadline=deadline)
+                    format_recipe_output(results, f"dietary restriction: {diet_restriction}", output=output)
                 
                 else:
                     print("Invalid command. Type 'help' to see available commands.")
@@ -0,0 +1,152 @@
+import json
+import os
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from search_index import DEFAULT_INDEX_DIR
+
+AUTOCOMPLETE_PATH = os.path.join(DEFAULT_INDEX_DIR, "autocomplete")
+
+
+def normalize(text: str) -> str:
+    """Lowercase and collapse whitespace (recipe names often contain runs of spaces)"""
+    return " ".join(str(text).lower().split())
+
+
+class PrefixIndex:
+    """Sorted-array prefix index with frequency-ranked completion.
+
+    ``keys`` is sorted, so every key sharing a prefix sits in one contiguous
+    slice found with two binary searches; ranking that slice is a single
+    ``argpartition`` over the parallel ``weights`` array.
+    """
+
+    def __init__(self, keys: List[str], weights, values):
+        self.keys = keys
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.values = np.asarray(values, dtype=np.int64)
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[str, float, int]]) -> "PrefixIndex":
+        """Build from ``(text, weight, value)`` tuples; duplicates keep the heaviest value"""
+        merged: Dict[str, Tuple[float, int]] = {}
+        for text, weight, value in entries:
+            key = normalize(text)
+            if not key:
+                continue
+            current = merged.get(key)
+            if current is None or weight > current[0]:
+                merged[key] = (weight, value)
+        keys = sorted(merged)
+        return cls(keys, [merged[k][0] for k in keys], [merged[k][1] for k in keys])
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\uffff", lo)
+        return lo, hi
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        prefix = normalize(prefix)
+        lo, hi = self._range(prefix)
+        if lo == hi:
+            return []
+        weights = self.weights[lo:hi]
+        if hi - lo > limit:
+            top = np.argpartition(-weights, limit)[:limit]
+        else:
+            top = np.arange(hi - lo)
+        top = top[np.argsort(-weights[top], kind="stable")]
+        return [self.keys[lo + i] for i in top]
+
+    def lookup(self, text: str) -> Optional[int]:
+        """Exact (normalised) match, returning the stored value"""
+        key = normalize(text)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.values[i])
+        return None
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "keys.json"), "w") as f:
+            json.dump(self.keys, f)
+        np.save(os.path.join(path, "weights.npy"), self.weights)
+        np.save(os.path.join(path, "values.npy"), self.values)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["PrefixIndex"]:
+        if not os.path.exists(os.path.join(path, "keys.json")):
+            return None
+        with open(os.path.join(path, "keys.json")) as f:
+            keys = json.load(f)
+        return cls(keys, np.load(os.path.join(path, "weights.npy")),
+                   np.load(os.path.join(path, "values.npy"), mmap_mode="r"))
+
+
+class Autocomplete:
+    """Recipe-name and ingredient completion backed by two prefix indexes"""
+
+    def __init__(self, names: PrefixIndex, ingredients: PrefixIndex):
+        self.names = names
+        self.ingredients = ingredients
+
+    @classmethod
+    def build(cls, recipes: Iterable[Dict[str, Any]]) -> "Autocomplete":
+        names = []
+        ingredient_counts: Dict[str, int] = {}
+        for recipe in recipes:
+            if recipe.get("name"):
+                # Popularity first, rating as a tie-breaker
+                weight = recipe.get("review_count", 0) + (recipe.get("avg_rating") or 0) / 10
+                names.append((recipe["name"], weight, int(recipe["original_id"])))
+            for ingredient in recipe.get("ingredients", []):
+                key = normalize(ingredient)
+                ingredient_counts[key] = ingredient_counts.get(key, 0) + 1
+        ingredients = PrefixIndex.build((k, c, -1) for k, c in ingredient_counts.items())
+        return cls(PrefixIndex.build(names), ingredients)
+
+    def save(self, path: str = AUTOCOMPLETE_PATH) -> None:
+        self.names.save(os.path.join(path, "names"))
+        self.ingredients.save(os.path.join(path, "ingredients"))
+
+    @classmethod
+    def load(cls, path: str = AUTOCOMPLETE_PATH) -> Optional["Autocomplete"]:
+        names = PrefixIndex.load(os.path.join(path, "names"))
+        ingredients = PrefixIndex.load(os.path.join(path, "ingredients"))
+        if names is None or ingredients is None:
+            return None
+        return cls(names, ingredients)
+
+    def complete(self, prefix: str, kind: str = "all", limit: int = 10) -> List[str]:
+        if kind == "names":
+            return self.names.complete(prefix, limit)
+        if kind == "ingredients":
+            return self.ingredients.complete(prefix, limit)
+        # Ingredients are a small vocabulary, so give them the first half ahead of the long tail of names
+        results = self.ingredients.complete(prefix, max(limit // 2, 1))
+        return results + [n for n in self.names.complete(prefix, limit) if n not in results][:limit - len(results)]
+
+    def resolve_name(self, name: str) -> Optional[int]:
+        """Map a typed recipe name to an original_id: exact match, else best completion"""
+        original_id = self.names.lookup(name)
+        if original_id is not None:
+            return original_id
+        completions = self.names.complete(name, 1)
+        return self.names.lookup(completions[0]) if completions else None
+
+
+def build_autocomplete(db, path: str = AUTOCOMPLETE_PATH) -> Autocomplete:
+    """Build name and ingredient completion indexes from the recipes collection"""
+    print("Building autocomplete index...")
+    cursor = db.recipes.find(
+        {},
+        {"name": 1, "ingredients": 1, "review_count": 1, "avg_rating": 1, "original_id": 1, "_id": 0},
+        batch_size=5000
+    )
+    autocomplete = Autocomplete.build(cursor)
+    autocomplete.save(path)
+    print(f"Indexed {len(autocomplete.names.keys)} names and "
+          f"{len(autocomplete.ingredients.keys)} ingredients into {path}")
+    return autocomplete
@@ -0,0 +1,140 @@
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from pymongo import MongoClient
+
+from review_storage import bucketed_reviews, seasonal_pipeline, trending_pipeline
+
+
+def _timed(fn: Callable[[], Any], repeat: int = 5) -> float:
+    """Median wall time of ``fn`` in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _mb(n: float) -> str:
+    return f"{n / 1024 / 1024:.1f}MB"
+
+
+def _print_row(label: str, before: str, after: str) -> None:
+    print(f"  {label:<38}{before:>14}{after:>14}")
+
+
+def bench_review_storage(db, samples: int = 50) -> Dict[str, Any]:
+    """Compare unbounded embedded reviews + reviews scans against the bucketed layout.
+
+    The "before" recipe documents are reconstructed for the most-reviewed
+    recipes in a scratch collection, so both layouts are measured on the same
+    server and data.
+    """
+    print("\n=== REVIEW STORAGE BENCHMARK ===")
+    popular = list(db.recipes.find({}, {"_id": 1}).sort("review_count", -1).limit(samples))
+    ids = [r["_id"] for r in popular]
+
+    # Rebuild the old layout (every review pushed onto the recipe) for the sample
+    db.bench_unbounded_recipes.drop()
+    db.recipes.aggregate([
+        {"$match": {"_id": {"$in": ids}}},
+        {"$lookup": {
+            "from": "reviews",
+            "localField": "_id",
+            "foreignField": "recipe_id",
+            "as": "all_reviews",
+            "pipeline": [{"$project": {"_id": 0, "rating": 1, "date": 1,
+                                       "summary": {"$substrCP": [{"$ifNull": ["$review", ""]}, 0, 100]}}}]
+        }},
+        {"$set": {"reviews": "$all_reviews"}},
+        {"$unset": "all_reviews"},
+        {"$out": "bench_unbounded_recipes"}
+    ])
+
+    def avg_size(collection: str) -> float:
+        result = list(db[collection].aggregate([
+            {"$match": {"_id": {"$in": ids}}},
+            {"$group": {"_id": None, "size": {"$avg": {"$bsonSize": "$$ROOT"}}}}
+        ]))
+        return result[0]["size"] if result else 0.0
+
+    # Working set estimate for the whole collection under the unbounded layout
+    embedded_bytes = list(db.reviews.aggregate([
+        {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": {
+            "rating": "$rating", "date": "$date",
+            "summary": {"$substrCP": [{"$ifNull": ["$review", ""]}, 0, 100]}
+        }}}}}
+    ], allowDiskUse=True))
+    current = db.command("collStats", "recipes")
+    buckets = db.command("collStats", "review_buckets")
+    recent_bytes = list(db.recipes.aggregate([
+        {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": {"r": {"$ifNull": ["$reviews", []]}}}}}}
+    ]))
+    unbounded_size = (current["size"] - (recent_bytes[0]["bytes"] if recent_bytes else 0)
+                      + (embedded_bytes[0]["bytes"] if embedded_bytes else 0))
+
+    results = {
+        "recipes_size_before": unbounded_size,
+        "recipes_size_after": current["size"],
+        "bucket_collection_size": buckets.get("size", 0),
+        "popular_doc_before": avg_size("bench_unbounded_recipes"),
+        "popular_doc_after": avg_size("recipes"),
+        "recipe_read_before": _timed(lambda: [db.bench_unbounded_recipes.find_one({"_id": i}) for i in ids]),
+        "recipe_read_after": _timed(lambda: [db.recipes.find_one({"_id": i}) for i in ids]),
+        "history_read_before": _timed(lambda: [list(db.reviews.find({"recipe_id": i})) for i in ids]),
+        "history_read_after": _timed(lambda: [bucketed_reviews(db, i) for i in ids]),
+    }
+
+    cutoff = datetime.now() - timedelta(days=365 * 20)
+    results["trending_before"] = _timed(lambda: list(db.reviews.aggregate([
+        {"$match": {"date": {"$gte": cutoff}}},
+        {"$group": {"_id": "$recipe_id", "recent_ratings": {"$avg": "$rating"}, "review_count": {"$sum": 1}}}
+    ], allowDiskUse=True)), repeat=3)
+    results["trending_after"] = _timed(
+        lambda: list(db.review_buckets.aggregate(trending_pipeline(cutoff), allowDiskUse=True)), repeat=3)
+    results["seasonal_before"] = _timed(lambda: list(db.reviews.aggregate([
+        {"$group": {"_id": {"recipe": "$recipe_id", "month": {"$month": "$date"}},
+                    "avg_rating": {"$avg": "$rating"}, "count": {"$sum": 1}}}
+    ], allowDiskUse=True)), repeat=3)
+    results["seasonal_after"] = _timed(
+        lambda: list(db.review_buckets.aggregate(seasonal_pipeline(), allowDiskUse=True)), repeat=3)
+    db.bench_unbounded_recipes.drop()
+
+    print(f"  {'':<38}{'before':>14}{'after':>14}")
+    _print_row("recipes collection size", _mb(results["recipes_size_before"]), _mb(results["recipes_size_after"]))
+    _print_row(f"avg size, top {samples} recipes (KB)",
+               f"{results['popular_doc_before'] / 1024:.1f}", f"{results['popular_doc_after'] / 1024:.1f}")
+    _print_row(f"read {samples} popular recipes (ms)",
+               f"{results['recipe_read_before']:.1f}", f"{results['recipe_read_after']:.1f}")
+    _print_row(f"read {samples} review histories (ms)",
+               f"{results['history_read_before']:.1f}", f"{results['history_read_after']:.1f}")
+    _print_row("trending aggregation (ms)", f"{results['trending_before']:.1f}", f"{results['trending_after']:.1f}")
+    _print_row("seasonal aggregation (ms)", f"{results['seasonal_before']:.1f}", f"{results['seasonal_after']:.1f}")
+    print(f"  review_buckets collection size: {_mb(results['bucket_collection_size'])}")
+    return results
+
+
+BENCHMARKS = {
+    "reviews": bench_review_storage,
+}
+
+
+def main(names: List[str]) -> None:
+    client = MongoClient('mongodb://mymongo:27017/')
+    try:
+        db = client['RecipeHub']
+        for name in names or list(BENCHMARKS):
+            if name not in BENCHMARKS:
+                print(f"Unknown benchmark '{name}'. Options: {', '.join(BENCHMARKS)}")
+                continue
+            BENCHMARKS[name](db)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
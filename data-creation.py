@@ -1,11 +1,32 @@
 import os
 import json
+import argparse
 import pandas as pd
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne
 from tqdm import tqdm
 import ast
-import kagglehub
+from review_storage import build_review_buckets, set_recent_reviews
+from search_index import build_search_index, refresh_search_index
+from dictionaries import encode_recipes, encode_new_recipes
+from autocomplete import build_autocomplete
+from query_planner import build_query_stats
+from pantry import build_pantry_index
+from nutrition_index import build_nutrition_index
+from review_index import build_review_index, refresh_review_index
+from sketches import build_sketches, record_recipes, record_reviews
+from taste_profiles import build_taste_profiles, apply_rating
+from leaderboards import build_leaderboards, refresh_recipes, GLOBAL_BOARD
+
+DATASET = "shuyangli94/food-com-recipes-and-user-interactions"
+
+REVIEW_BATCH_SIZE = 5000
+
+# Rows read per CSV chunk in incremental mode; progress is checkpointed after each chunk
+CHUNK_SIZE = 5000
+
+# Source fields compared to decide whether an existing recipe changed
+RECIPE_FIELDS = ("name", "ingredients", "steps", "minutes", "tags", "nutrition", "n_steps", "n_ingredients")
 
 def connect_to_mongodb():
     client = MongoClient('mongodb://mymongo:27017/')
@@ -32,6 +53,33 @@ def process_nutrition(nutrition_str):
     except:
         return {}
 
+def build_recipe_doc(row):
+    """Recipe document for one RAW_recipes.csv row"""
+    return {
+        "original_id": row['id'],
+        "name": row['name'],
+        "ingredients": ast.literal_eval(row['ingredients']),
+        "steps": ast.literal_eval(row['steps']),
+        "minutes": row['minutes'],
+        "tags": ast.literal_eval(row['tags']),
+        "nutrition": process_nutrition(row['nutrition']),
+        "source_dataset": "shuyangli94",
+        "n_steps": row['n_steps'],
+        "n_ingredients": row['n_ingredients'],
+        "reviews": []
+    }
+
+def build_review_doc(row, recipe_id):
+    """Review document for one RAW_interactions.csv row"""
+    return {
+        "recipe_id": recipe_id,
+        "user_id": row['user_id'],
+        "date": datetime.strptime(row['date'], '%Y-%m-%d'),
+        "rating": row['rating'],
+        "review": row['review'],
+        "source_dataset": "shuyangli94"
+    }
+
 def import_shuyangli_dataset(path, db):
     """Import data from shuyangli94 dataset"""
     recipes_df = pd.read_csv(f"{path}/RAW_recipes.csv")
@@ -41,19 +89,7 @@ def import_shuyangli_dataset(path, db):
     print("Processing shuyangli94 recipes...")
     for _, row in tqdm(recipes_df.iterrows(), total=len(recipes_df)):
         try:
-            recipe_doc = {
-                "original_id": row['id'],
-                "name": row['name'],
-                "ingredients": ast.literal_eval(row['ingredients']),
-                "steps": ast.literal_eval(row['steps']),
-                "minutes": row['minutes'],
-                "tags": ast.literal_eval(row['tags']),
-                "nutrition": process_nutrition(row['nutrition']),
-                "source_dataset": "shuyangli94",
-                "n_steps": row['n_steps'],
-                "n_ingredients": row['n_ingredients'],
-                "reviews": []
-            }
+            recipe_doc = build_recipe_doc(row)
 
             result = db.recipes.insert_one(recipe_doc)
             recipe_id_mapping[row['id']] = result.inserted_id
@@ -62,30 +98,21 @@ def import_shuyangli_dataset(path, db):
             continue
 
     print("Processing shuyangli94 interactions...")
+    # Reviews go only to the reviews collection here; recipes get a bounded
+    # recent-review slice and the full history is bucketed afterwards
+    batch = []
     for _, row in tqdm(interactions_df.iterrows(), total=len(interactions_df)):
         try:
             if row['recipe_id'] in recipe_id_mapping:
-                review_doc = {
-                    "recipe_id": recipe_id_mapping[row['recipe_id']],
-                    "user_id": row['user_id'],
-                    "date": datetime.strptime(row['date'], '%Y-%m-%d'),
-                    "rating": row['rating'],
-                    "review": row['review'],
-                    "source_dataset": "shuyangli94"
-                }
-                db.reviews.insert_one(review_doc)
-
-                db.recipes.update_one(
-                    {"_id": recipe_id_mapping[row['recipe_id']]},
-                    {"$push": {"reviews": {
-                        "rating": row['rating'],
-                        "date": datetime.strptime(row['date'], '%Y-%m-%d'),
-                        "summary": row['review'][:100] if pd.notna(row['review']) else None
-                    }}}
-                )
+                batch.append(build_review_doc(row, recipe_id_mapping[row['recipe_id']]))
+                if len(batch) >= REVIEW_BATCH_SIZE:
+                    db.reviews.insert_many(batch, ordered=False)
+                    batch = []
         except Exception as e:
             print(f"Error processing review for recipe {row['recipe_id']}: {e}")
             continue
+    if batch:
+        db.reviews.insert_many(batch, ordered=False)
 
 def create_indexes(db):
     """Create indexes for better query performance"""
@@ -93,6 +120,8 @@ def create_indexes(db):
 
     # Existing indexes
     db.recipes.create_index([("name", "text"), ("ingredients", "text")])
+    db.recipes.create_index("original_id")
+    db.recipes.create_index("name")
     db.recipes.create_index("source_dataset")
     db.recipes.create_index("tags")
     db.recipes.create_index("minutes")
@@ -100,6 +129,7 @@ def create_indexes(db):
     db.recipes.create_index([("nutrition.calories", 1)])
 
     db.reviews.create_index("recipe_id")
+    db.reviews.create_index([("recipe_id", 1), ("user_id", 1)])
     db.reviews.create_index("user_id")
     db.reviews.create_index("date")
     db.reviews.create_index("rating")
@@ -109,13 +139,19 @@ def create_indexes(db):
     db.recipes.create_index([("avg_rating", -1)])
     db.recipes.create_index([("ingredients", 1)])
 
+    # Recipes waiting for derived data after an incremental import
+    db.recipes.create_index("pending_refresh", sparse=True)
+    # Ratings from the app waiting for the review text index
+    db.reviews.create_index("index_pending", sparse=True)
+
     print("Indexes created successfully!")
 
-def calculate_recipe_stats(db):
-    """Calculate and update recipe statistics"""
+def calculate_recipe_stats(db, match=None):
+    """Calculate and update recipe statistics, optionally only for reviews matching ``match``"""
     print("Calculating recipe statistics...")
 
-    pipeline = [
+    pipeline = [{"$match": match}] if match else []
+    pipeline += [
         {
             "$group": {
                 "_id": "$recipe_id",
@@ -147,6 +183,206 @@ def calculate_recipe_stats(db):
         except Exception as e:
             print(f"Error calculating stats for recipe {stat['_id']}: {e}")
             continue
+
+def download_dataset():
+    import kagglehub  # only needed when no local copy of the CSVs is given
+    return kagglehub.dataset_download(DATASET)
+
+def load_checkpoint(db, path):
+    """Resume an unfinished incremental import, or start a new run"""
+    checkpoint = db.import_checkpoints.find_one({"_id": "shuyangli94"})
+    if checkpoint and checkpoint["phase"] != "done":
+        print(f"Resuming import started {checkpoint['run']:%Y-%m-%d %H:%M} "
+              f"at {checkpoint['phase']}, position {checkpoint['position']}")
+        return checkpoint
+    checkpoint = {"_id": "shuyangli94", "source": path, "run": datetime.now(),
+                  "phase": "recipes", "position": 0}
+    db.import_checkpoints.replace_one({"_id": checkpoint["_id"]}, checkpoint, upsert=True)
+    return checkpoint
+
+def save_checkpoint(db, checkpoint, phase, position):
+    checkpoint.update({"phase": phase, "position": position, "updated_at": datetime.now()})
+    db.import_checkpoints.replace_one({"_id": checkpoint["_id"]}, checkpoint)
+
+def read_chunks(csv_path, skip):
+    """CSV rows in CHUNK_SIZE chunks, skipping the first ``skip`` data rows"""
+    return pd.read_csv(csv_path, chunksize=CHUNK_SIZE, skiprows=range(1, skip + 1))
+
+def upsert_recipes(path, db, checkpoint):
+    """Insert new recipes and update changed ones by original_id, flagging both for refresh"""
+    print("Upserting recipes...")
+    position = checkpoint["position"]
+    added = changed = 0
+    projection = dict.fromkeys(RECIPE_FIELDS + ("original_id",), 1)
+    for chunk in tqdm(read_chunks(f"{path}/RAW_recipes.csv", position), unit="chunk"):
+        docs = {}
+        for _, row in chunk.iterrows():
+            try:
+                docs[row['id']] = build_recipe_doc(row)
+            except Exception as e:
+                print(f"Error processing recipe {row['id']}: {e}")
+
+        existing = {r["original_id"]: r for r in db.recipes.find({"original_id": {"$in": list(docs)}}, projection)}
+        writes = []
+        for original_id, doc in docs.items():
+            current = existing.get(original_id)
+            if current is None:
+                writes.append(InsertOne({**doc, "pending_refresh": "new"}))
+                added += 1
+            elif any(current.get(field) != doc[field] for field in RECIPE_FIELDS):
+                fields = {field: doc[field] for field in RECIPE_FIELDS}
+                writes.append(UpdateOne({"_id": current["_id"]}, {"$set": {**fields, "pending_refresh": "changed"}}))
+                changed += 1
+        if writes:
+            db.recipes.bulk_write(writes, ordered=False)
+        position += len(chunk)
+        save_checkpoint(db, checkpoint, "recipes", position)
+    print(f"Recipes: {added} new, {changed} changed")
+
+def insert_new_reviews(path, db, checkpoint):
+    """Insert reviews not already stored, keyed by (recipe, user, date)"""
+    print("Inserting new reviews...")
+    recipe_ids = {r["original_id"]: r["_id"] for r in db.recipes.find({}, {"original_id": 1})}
+    position = checkpoint["position"]
+    inserted = 0
+    for chunk in tqdm(read_chunks(f"{path}/RAW_interactions.csv", position), unit="chunk"):
+        docs = []
+        for _, row in chunk.iterrows():
+            try:
+                if row['recipe_id'] in recipe_ids:
+                    docs.append(build_review_doc(row, recipe_ids[row['recipe_id']]))
+            except Exception as e:
+                print(f"Error processing review for recipe {row['recipe_id']}: {e}")
+
+        # Re-reading a chunk after an interruption is harmless: anything stored is skipped here
+        seen = {(r["recipe_id"], r["user_id"], r["date"]) for r in db.reviews.find(
+            {"recipe_id": {"$in": list({d["recipe_id"] for d in docs})},
+             "user_id": {"$in": list({d["user_id"] for d in docs})}},
+            {"recipe_id": 1, "user_id": 1, "date": 1, "_id": 0}
+        )}
+        new = []
+        for doc in docs:
+            key = (doc["recipe_id"], doc["user_id"], doc["date"])
+            if key not in seen:
+                seen.add(key)
+                new.append({**doc, "import_run": checkpoint["run"]})
+        if new:
+            # Flag first: once stored, a resumed run skips these reviews and would never flag their recipes
+            db.recipes.update_many(
+                {"_id": {"$in": list({d["recipe_id"] for d in new})}, "pending_refresh": {"$exists": False}},
+                {"$set": {"pending_refresh": "reviewed"}}
+            )
+            db.reviews.insert_many(new, ordered=False)
+            inserted += len(new)
+        position += len(chunk)
+        save_checkpoint(db, checkpoint, "reviews", position)
+    print(f"Reviews: {inserted} new")
+
+def apply_new_ratings(db, run):
+    """Fold the run's reviews into taste profiles, each exactly once and as a revision of any earlier rating"""
+    recipes = {r["_id"]: r for r in db.recipes.find(
+        {"pending_refresh": {"$exists": True}}, {"ingredient_ids": 1, "tag_ids": 1})}
+    # Flagged reviews were applied before an interruption; oldest first so re-ratings chain
+    pending = db.reviews.find({"import_run": run, "applied_to_profile": {"$exists": False}},
+                              {"user_id": 1, "recipe_id": 1, "rating": 1, "date": 1}).sort("date", 1)
+    for review in pending:
+        recipe = recipes.get(review["recipe_id"])
+        if recipe is not None:
+            previous = db.reviews.find_one(
+                {"user_id": review["user_id"], "recipe_id": review["recipe_id"], "date": {"$lt": review["date"]}},
+                {"rating": 1}, sort=[("date", -1)])
+            apply_rating(db, review["user_id"], recipe, review["rating"],
+                         previous["rating"] if previous else None)
+        db.reviews.update_one({"_id": review["_id"]}, {"$set": {"applied_to_profile": True}})
+
+def refresh_leaderboards(db, recipe_ids):
+    if db.leaderboards.find_one({"_id": GLOBAL_BOARD}, {"_id": 1}) is None:
+        build_leaderboards(db)
+    else:
+        refresh_recipes(db, recipe_ids)
+
+def refresh_sketches(db, run, rebuild):
+    if rebuild:
+        build_sketches(db)
+        return
+    # Sketches can't forget old values, so changed recipes are only counted when new
+    record_recipes(db, db.recipes.find({"pending_refresh": "new"}, {"nutrition": 1, "avg_rating": 1, "ingredients": 1}),
+                   run)
+    record_reviews(db, db.reviews.find({"import_run": run}, {"recipe_id": 1, "user_id": 1, "date": 1}))
+
+def refresh_taste_profiles(db, run, rebuild):
+    if rebuild:
+        build_taste_profiles(db)
+    else:
+        apply_new_ratings(db, run)
+
+def missing_derived(db):
+    """Derived collections that don't exist yet, so a refresh must build them in full rather than patch them"""
+    return [name for name in ("review_buckets", "sketches", "recipe_sketches", "taste_profiles")
+            if db[name].find_one({}, {"_id": 1}) is None]
+
+def refresh_touched_recipes(db, checkpoint):
+    """Bring derived data up to date for recipes flagged by the import, one checkpointed step at a time"""
+    touched = {"pending_refresh": {"$exists": True}}
+    recipe_ids = [r["_id"] for r in db.recipes.find(touched, {"_id": 1})]
+    original_ids = [r["original_id"] for r in db.recipes.find(touched, {"original_id": 1})]
+    if not recipe_ids:
+        print("No new or changed recipes; nothing to refresh")
+        return
+    print(f"Refreshing {len(recipe_ids)} touched recipes...")
+    if "rebuild" not in checkpoint:
+        # Decided once per run, so a resumed refresh doesn't mistake its own partial output for a full build
+        checkpoint["rebuild"] = missing_derived(db)
+        save_checkpoint(db, checkpoint, "refresh", checkpoint["position"])
+    rebuild = set(checkpoint["rebuild"])
+    if rebuild:
+        print(f"Building {', '.join(sorted(rebuild))} in full")
+    by_recipe = None if "review_buckets" in rebuild else {"recipe_id": {"$in": recipe_ids}}
+    steps = [
+        lambda: calculate_recipe_stats(db, {"recipe_id": {"$in": recipe_ids}}),
+        lambda: build_review_buckets(db, by_recipe),
+        lambda: set_recent_reviews(db, by_recipe),
+        lambda: encode_new_recipes(db, touched),
+        lambda: refresh_sketches(db, checkpoint["run"], bool(rebuild & {"sketches", "recipe_sketches"})),
+        lambda: refresh_taste_profiles(db, checkpoint["run"], "taste_profiles" in rebuild),
+        lambda: refresh_leaderboards(db, recipe_ids),
+        lambda: refresh_search_index(db, original_ids),
+        lambda: refresh_review_index(db, checkpoint["run"]),
+        # These are cheap to rebuild from the recipes collection and have no delta path
+        lambda: build_autocomplete(db),
+        lambda: build_query_stats(db),
+        lambda: build_pantry_index(db),
+        lambda: build_nutrition_index(db),
+        lambda: db.recipes.update_many(touched, {"$unset": {"pending_refresh": ""}}),
+    ]
+    for step in range(checkpoint["position"], len(steps)):
+        steps[step]()
+        save_checkpoint(db, checkpoint, "refresh", step + 1)
+
+def import_incremental(path, db):
+    """Apply the dataset at ``path`` on top of the existing database; safe to re-run after an interruption"""
+    create_indexes(db)
+    checkpoint = load_checkpoint(db, path)
+    if checkpoint["phase"] == "recipes":
+        upsert_recipes(path, db, checkpoint)
+        save_checkpoint(db, checkpoint, "reviews", 0)
+    if checkpoint["phase"] == "reviews":
+        insert_new_reviews(path, db, checkpoint)
+        save_checkpoint(db, checkpoint, "refresh", 0)
+    if checkpoint["phase"] == "refresh":
+        refresh_touched_recipes(db, checkpoint)
+        save_checkpoint(db, checkpoint, "done", 0)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import the Food.com recipes dataset into MongoDB")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert new/changed recipes and new reviews instead of dropping and reloading; "
+                             "resumes an interrupted incremental run")
+    parser.add_argument("--source", metavar="DIR",
+                        help="directory containing RAW_recipes.csv and RAW_interactions.csv "
+                             "(default: download with kagglehub)")
+    return parser.parse_args()
+
 def analyze_dataset_coverage(db):
     """Analyze and print statistics about dataset coverage"""
     print("\nDataset Coverage Analysis:")
@@ -158,20 +394,39 @@ def analyze_dataset_coverage(db):
     print(f"Total reviews: {total_reviews}")
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
         client, db = connect_to_mongodb()
-        db.recipes.drop()
-        db.reviews.drop()
-
-        shuyangli_path = kagglehub.dataset_download(
-            "shuyangli94/food-com-recipes-and-user-interactions"
-        )
-        import_shuyangli_dataset(shuyangli_path, db)
-        create_indexes(db)
-        calculate_recipe_stats(db)
-        analyze_dataset_coverage(db)
-
-        print("Data import and processing completed successfully!")
+        shuyangli_path = args.source or download_dataset()
+
+        if args.incremental:
+            import_incremental(shuyangli_path, db)
+            analyze_dataset_coverage(db)
+            print("Incremental import completed successfully!")
+        else:
+            db.recipes.drop()
+            db.reviews.drop()
+            db.review_buckets.drop()
+            db.import_checkpoints.drop()
+
+            import_shuyangli_dataset(shuyangli_path, db)
+            create_indexes(db)
+            calculate_recipe_stats(db)
+            build_review_buckets(db)
+            set_recent_reviews(db)
+            encode_recipes(db)
+            build_taste_profiles(db)
+            build_leaderboards(db)
+            build_search_index(db)
+            build_review_index(db)
+            build_autocomplete(db)
+            build_query_stats(db)
+            build_pantry_index(db)
+            build_nutrition_index(db)
+            build_sketches(db)
+            analyze_dataset_coverage(db)
+
+            print("Data import and processing completed successfully!")
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -0,0 +1,106 @@
+import os
+import time
+from collections import Counter
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+import pymongo
+from pymongo.errors import PyMongoError
+
+# Seconds a RecipeApp call may spend in MongoDB unless the caller passes ``deadline=``; 0 disables
+DEFAULT_DEADLINE = float(os.environ.get("RECIPEHUB_DEADLINE", "5"))
+
+# Extra seconds granted to the cheaper fallback once the deadline has passed
+FALLBACK_BUDGET = 1.0
+
+
+class DegradedResults(list):
+    """List result produced by a fallback after the deadline ran out"""
+    degraded = True
+
+
+def is_timeout(error: BaseException) -> bool:
+    return isinstance(error, PyMongoError) and error.timeout
+
+
+def mark_degraded(result: Any) -> Any:
+    if isinstance(result, dict):
+        result["degraded"] = True
+        return result
+    if isinstance(result, list):
+        return DegradedResults(result)
+    return result
+
+
+def is_degraded(result: Any) -> bool:
+    if isinstance(result, dict):
+        return bool(result.get("degraded"))
+    return getattr(result, "degraded", False)
+
+
+class DeadlineStats:
+    """Per-method call and degradation counters"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.degraded = Counter()
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"calls": calls, "degraded": self.degraded[name], "rate": self.degraded[name] / calls}
+            for name, calls in sorted(self.calls.items())
+        }
+
+
+def with_deadline(empty: Callable[[], Any] = list, fallback: bool = True, write: bool = False):
+    """Bound every MongoDB operation of a RecipeApp method by one deadline.
+
+    The method gains a ``deadline=`` keyword (seconds, default
+    ``self.default_deadline``) that is applied with ``pymongo.timeout`` so it
+    propagates to each find/aggregate/getMore. When it runs out, the method is
+    run again with ``self._fallback`` set, which makes it take its cheaper
+    precomputed or approximate path, under FALLBACK_BUDGET. If that fails too,
+    or the method has no fallback, ``empty()`` is returned. Either way the
+    result is flagged as degraded and counted. Writes pass ``write=True``:
+    they run unbounded whatever ``deadline=`` says, since a timeout between
+    their steps would leave derived data stale, and any error is re-raised.
+
+    Calls made from inside another bounded method share the outer deadline.
+    """
+    def decorate(fn):
+        name = fn.__name__
+
+        @wraps(fn)
+        def wrapper(self, *args, deadline: Optional[float] = None, **kwargs):
+            if self._deadline_at is not None and deadline is None:
+                return fn(self, *args, **kwargs)
+
+            seconds = None if write else (self.default_deadline if deadline is None else deadline) or None
+            self.deadline_stats.calls[name] += 1
+            self._deadline_at = time.monotonic() + seconds if seconds else float("inf")
+            try:
+                with pymongo.timeout(seconds):
+                    return fn(self, *args, **kwargs)
+            except PyMongoError as e:
+                if write or not is_timeout(e):
+                    raise
+            finally:
+                self._deadline_at = None
+
+            self.deadline_stats.degraded[name] += 1
+            result = empty() if empty else None
+            if fallback:
+                self._fallback = True
+                self._deadline_at = time.monotonic() + FALLBACK_BUDGET
+                try:
+                    with pymongo.timeout(FALLBACK_BUDGET):
+                        result = fn(self, *args, **kwargs)
+                except PyMongoError as e:
+                    if not is_timeout(e):
+                        raise
+                finally:
+                    self._fallback = False
+                    self._deadline_at = None
+            return mark_degraded(result)
+        return wrapper
+    return decorate
@@ -0,0 +1,177 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+# Collection holding each dictionary, and the recipe fields they encode
+DICTIONARIES = {
+    "ingredients": ("ingredient_dictionary", "ingredient_ids"),
+    "tags": ("tag_dictionary", "tag_ids"),
+}
+
+
+class Dictionary:
+    """Bidirectional string <-> integer ID mapping backed by a Mongo collection.
+
+    IDs are assigned in descending frequency order at build time, and new
+    strings seen later are appended after the current maximum.
+    """
+
+    def __init__(self, collection, names: Dict[str, int]):
+        self.collection = collection
+        self.ids = names
+        self.names = {i: n for n, i in names.items()}
+        self._next_id = max(self.names, default=-1) + 1
+
+    @classmethod
+    def load(cls, collection) -> Optional["Dictionary"]:
+        names = {doc["name"]: doc["_id"] for doc in collection.find({}, {"name": 1})}
+        return cls(collection, names) if names else None
+
+    def encode(self, names: Iterable[str], create: bool = False) -> List[int]:
+        """Map strings to IDs, dropping unknown ones unless ``create`` adds them"""
+        encoded = []
+        for name in names:
+            if name not in self.ids:
+                if not create:
+                    continue
+                new_id = self._next_id
+                self._next_id += 1
+                self.collection.insert_one({"_id": new_id, "name": name, "count": 0})
+                self.ids[name] = new_id
+                self.names[new_id] = name
+            encoded.append(self.ids[name])
+        return encoded
+
+    def decode(self, ids: Iterable[int]) -> List[str]:
+        return [self.names[i] for i in ids if i in self.names]
+
+    def matching(self, fragment: str) -> List[int]:
+        """IDs of every entry containing ``fragment`` (case-insensitive)"""
+        fragment = fragment.lower()
+        return [i for n, i in self.ids.items() if fragment in n.lower()]
+
+
+def build_dictionary(values: Iterable[List[str]], collection) -> Dictionary:
+    """Count every string and store a frequency-ordered dictionary"""
+    counts: Dict[str, int] = {}
+    for items in values:
+        for item in items:
+            counts[item] = counts.get(item, 0) + 1
+    ordered = sorted(counts, key=lambda n: (-counts[n], n))
+    collection.drop()
+    if ordered:
+        collection.insert_many([{"_id": i, "name": n, "count": counts[n]} for i, n in enumerate(ordered)])
+        collection.create_index("name", unique=True)
+    return Dictionary(collection, {n: i for i, n in enumerate(ordered)})
+
+
+def load_dictionaries(db) -> Dict[str, Dictionary]:
+    """Load both dictionaries; empty when the database has not been encoded yet"""
+    loaded = {}
+    for field, (collection, _) in DICTIONARIES.items():
+        dictionary = Dictionary.load(db[collection])
+        if dictionary is None:
+            return {}
+        loaded[field] = dictionary
+    return loaded
+
+
+def collection_size_report(db, collection: str = "recipes") -> Dict[str, Any]:
+    stats = db.command("collStats", collection)
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "avg_obj_size": stats.get("avgObjSize", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "total_index_size": stats.get("totalIndexSize", 0),
+        "index_sizes": stats.get("indexSizes", {}),
+    }
+
+
+def encoded_field_sizes(db) -> Dict[str, int]:
+    """Total BSON bytes of the string arrays versus their integer-ID encodings"""
+    sizes = {}
+    for field, (_, id_field) in DICTIONARIES.items():
+        for name in (field, id_field):
+            result = list(db.recipes.aggregate([
+                {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": {"v": {"$ifNull": [f"${name}", []]}}}}}}
+            ]))
+            sizes[name] = result[0]["bytes"] if result else 0
+    return sizes
+
+
+def _fmt_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def print_size_report(db, before: Dict[str, Any], after: Dict[str, Any]) -> None:
+    """Compare recipes collection/index sizes and string vs ID field sizes"""
+    print("\nDictionary Encoding Size Report:")
+    print(f"Collection size: {_fmt_bytes(before['size'])} -> {_fmt_bytes(after['size'])}")
+    print(f"Average document: {_fmt_bytes(before['avg_obj_size'])} -> {_fmt_bytes(after['avg_obj_size'])}")
+    print(f"Total index size: {_fmt_bytes(before['total_index_size'])} -> {_fmt_bytes(after['total_index_size'])}")
+
+    fields = encoded_field_sizes(db)
+    string_bytes = sum(fields[field] for field in DICTIONARIES)
+    print(f"Projected collection size storing IDs only: {_fmt_bytes(after['size'] - string_bytes)}")
+
+    indexes = after["index_sizes"]
+    for field, (_, id_field) in DICTIONARIES.items():
+        print(f"\n{field}:")
+        print(f"  Field bytes (strings vs IDs): {_fmt_bytes(fields[field])} vs {_fmt_bytes(fields[id_field])}")
+        string_index = indexes.get(f"{field}_1")
+        id_index = indexes.get(f"{id_field}_1")
+        if string_index is not None and id_index is not None:
+            print(f"  Index size (strings vs IDs): {_fmt_bytes(string_index)} vs {_fmt_bytes(id_index)}")
+
+
+def _encode_matching(db, dictionaries: Dict[str, Dictionary], match: Dict[str, Any],
+                     create: bool = False, batch_size: int = 1000) -> int:
+    updates = []
+    count = 0
+    projection = {field: 1 for field in DICTIONARIES}
+    for recipe in db.recipes.find(match, projection, batch_size=5000):
+        encoded = {id_field: dictionaries[field].encode(recipe.get(field, []), create=create)
+                   for field, (_, id_field) in DICTIONARIES.items()}
+        updates.append(UpdateOne({"_id": recipe["_id"]}, {"$set": encoded}))
+        count += 1
+        if len(updates) >= batch_size:
+            db.recipes.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        db.recipes.bulk_write(updates, ordered=False)
+    return count
+
+
+def encode_recipes(db, batch_size: int = 1000) -> Dict[str, Dictionary]:
+    """Build both dictionaries from existing recipes and add the ID arrays in place"""
+    print("Building ingredient and tag dictionaries...")
+    before = collection_size_report(db)
+
+    dictionaries = {}
+    for field, (collection, _) in DICTIONARIES.items():
+        values = (r.get(field, []) for r in db.recipes.find({}, {field: 1, "_id": 0}, batch_size=5000))
+        dictionaries[field] = build_dictionary(values, db[collection])
+        print(f"{field}: {len(dictionaries[field].ids)} distinct values")
+
+    print("Encoding recipes...")
+    _encode_matching(db, dictionaries, {}, batch_size=batch_size)
+
+    for _, id_field in DICTIONARIES.values():
+        db.recipes.create_index(id_field)
+
+    print_size_report(db, before, collection_size_report(db))
+    return dictionaries
+
+
+def encode_new_recipes(db, match: Dict[str, Any]) -> int:
+    """Encode recipes added or changed since the last full build, growing the dictionaries as needed"""
+    dictionaries = load_dictionaries(db)
+    if not dictionaries:
+        encode_recipes(db)
+        return db.recipes.count_documents(match)
+    return _encode_matching(db, dictionaries, match, create=True)
@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Lower bounds of each bucket; the last bucket is open-ended
+TIME_BUCKETS = [0, 15, 30, 60, 120]
+CALORIE_BUCKETS = [0, 300, 600, 1000, 2000]
+RATING_BANDS = [0, 3, 4, 4.5]
+TOP_TAGS = 10
+
+FACET_CACHE_SIZE = 128
+FACET_CACHE_TTL = 300  # seconds; ratings drift slowly and rate_recipe clears the cache anyway
+
+
+def _bucket_stage(field: str, boundaries: List[float]) -> List[Dict[str, Any]]:
+    # Non-numeric/missing values are dropped first so $bucket's default holds only the open top bucket
+    return [
+        {"$match": {field: {"$type": "number"}}},
+        {"$bucket": {
+            "groupBy": f"${field}",
+            "boundaries": boundaries,
+            "default": boundaries[-1],
+            "output": {"count": {"$sum": 1}}
+        }}
+    ]
+
+
+def facet_pipeline(match: Dict[str, Any], hits: List[Dict[str, Any]], tag_field: str = "tags") -> List[Dict[str, Any]]:
+    """One aggregation returning the top hits and every facet over all documents matching ``match``.
+
+    ``hits`` is the sub-pipeline producing the result rows (sort, limit, project).
+    """
+    return [
+        {"$match": match},
+        {"$facet": {
+            "hits": hits,
+            "total": [{"$count": "count"}],
+            "cooking_time": _bucket_stage("minutes", TIME_BUCKETS),
+            "calories": _bucket_stage("nutrition.calories", CALORIE_BUCKETS),
+            "rating": _bucket_stage("avg_rating", RATING_BANDS),
+            "tags": [
+                {"$unwind": f"${tag_field}"},
+                {"$sortByCount": f"${tag_field}"},
+                {"$limit": TOP_TAGS}
+            ]
+        }}
+    ]
+
+
+def _range_label(boundaries: List[float], low: float, unit: str) -> str:
+    i = boundaries.index(low)
+    if i + 1 < len(boundaries):
+        return f"{low:g}-{boundaries[i + 1]:g}{unit}"
+    return f"{low:g}+{unit}"
+
+
+def format_facets(result: Dict[str, Any], tag_names: Dict[int, str] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Turn raw $facet output into labelled ``{"label", "count"}`` rows, buckets in ascending order.
+
+    ``tag_names`` decodes tag IDs when the tags facet was computed over ``tag_ids``.
+    """
+    def buckets(name: str, boundaries: List[float], unit: str) -> List[Dict[str, Any]]:
+        counts = {b["_id"]: b["count"] for b in result.get(name, [])}
+        return [{"label": _range_label(boundaries, low, unit), "count": counts[low]}
+                for low in boundaries if low in counts]
+
+    tags = result.get("tags", [])
+    names = [tag_names.get(t["_id"], str(t["_id"])) if tag_names else t["_id"] for t in tags]
+    return {
+        "cooking_time": buckets("cooking_time", TIME_BUCKETS, " min"),
+        "calories": buckets("calories", CALORIE_BUCKETS, " kcal"),
+        "rating": buckets("rating", RATING_BANDS, " stars"),
+        "tags": [{"label": name, "count": t["count"]} for name, t in zip(names, tags)]
+    }
+
+
+class FacetCache:
+    """Small LRU of faceted results keyed on the normalised query, with a time-to-live"""
+
+    def __init__(self, size: int = FACET_CACHE_SIZE, ttl: float = FACET_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def key(kind: str, term: str, limit: int) -> Tuple[str, str, int]:
+        return kind, " ".join(term.lower().split()), limit
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Tuple, value: Dict[str, Any]) -> None:
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
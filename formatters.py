@@ -1,5 +1,170 @@
-from typing import Dict, Any, List
+import csv
+import json
+import sys
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from functools import wraps
+from typing import Dict, Any, Iterable, List, Optional
 
+from bson import ObjectId
+
+from deadlines import is_degraded
+
+OUTPUT_MODES = ("text", "jsonl", "csv")
+
+DEGRADED_NOTICE = "Note: the query ran out of time; showing a cheaper, approximate answer"
+
+# Column order for recipe rows in CSV mode; nested nutrition is flattened to nutrition.<field>
+RECIPE_CSV_FIELDS = [
+    "original_id", "_id", "name", "minutes", "avg_rating", "review_count", "score", "match_score", "distance",
+    "common_ingredients", "missing_ingredients", "ingredients", "tags",
+    "nutrition.calories", "nutrition.total_fat", "nutrition.sugar", "nutrition.sodium",
+    "nutrition.protein", "nutrition.saturated_fat", "nutrition.carbohydrates"
+]
+
+REVIEW_CSV_FIELDS = ["_id", "recipe_id", "recipe_name", "user_id", "date", "rating", "score", "snippet"]
+
+_stream = None
+
+
+def _output_stream():
+    """One block-buffered stream over stdout, so output isn't flushed line by line on a terminal"""
+    global _stream
+    if _stream is None:
+        try:
+            _stream = open(sys.stdout.fileno(), "w", buffering=1 << 16, encoding="utf-8",
+                           newline="", closefd=False)
+        except (AttributeError, OSError, ValueError):  # stdout replaced, e.g. captured
+            _stream = sys.stdout
+    return _stream
+
+
+@contextmanager
+def buffered_output():
+    """Route print() through the buffered stream and flush once at the end"""
+    sys.stdout.flush()
+    stream = _output_stream()
+    try:
+        with redirect_stdout(stream):
+            yield stream
+    finally:
+        stream.flush()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    if hasattr(value, "to_dict"):  # slotted result models
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_json = json.JSONEncoder(default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def _flatten(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Dotted keys for nested dicts; lists joined with '|' so each record is one CSV row"""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (list, tuple)):
+            flat[name] = "|".join(_json.encode(v) if isinstance(v, dict) else str(v) for v in value)
+        elif isinstance(value, (ObjectId, datetime)):
+            flat[name] = _json_default(value)
+        else:
+            flat[name] = value
+    return flat
+
+
+def write_records(records: Iterable[Dict[str, Any]], output: str,
+                  fields: Optional[List[str]] = None) -> None:
+    """Write records as JSON Lines or CSV, one row per record as the iterable yields them"""
+    sys.stdout.flush()
+    stream = _output_stream()
+    try:
+        if output == "jsonl":
+            encode = _json.encode
+            for record in records:
+                stream.write(encode(record))
+                stream.write("\n")
+        elif output == "csv":
+            rows = (_flatten(r) for r in records)
+            if fields is None:
+                # Unknown shape: materialise to collect the union of columns in first-seen order
+                rows = list(rows)
+                fields = list(dict.fromkeys(k for row in rows for k in row))
+            writer = csv.DictWriter(stream, fieldnames=fields, extrasaction="ignore", lineterminator="\n")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+        else:
+            raise ValueError(f"Unknown output mode '{output}'. Options: {', '.join(OUTPUT_MODES)}")
+    finally:
+        stream.flush()
+
+
+def _formatter(to_records, fields: Optional[List[str]] = None):
+    """Give a text formatter buffered output plus jsonl/csv modes via ``output=``"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(data, *args, output: str = "text", **kwargs):
+            if output == "text":
+                with buffered_output():
+                    if is_degraded(data):
+                        print(f"\n{DEGRADED_NOTICE}")
+                    return fn(data, *args, **kwargs)
+            if is_degraded(data):
+                print(DEGRADED_NOTICE, file=sys.stderr)  # keep machine-readable stdout clean
+            write_records(to_records(data) if data else [], output, fields)
+        return wrapper
+    return decorate
+
+
+def _trend_records(trend_data: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    for rank, recipe in enumerate(trend_data["trending_recipes"], 1):
+        yield {"section": "trending", "month": None, "rank": rank, **recipe}
+    for month, data in trend_data["seasonal_patterns"].items():
+        for rank, recipe in enumerate(data["top_recipes"], 1):
+            yield {"section": "seasonal", "month": month, "rank": rank, **recipe}
+
+
+def _nutrition_records(nutrition_data: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    if not nutrition_data["overall_stats"]:
+        return
+    yield {"section": "overall", **nutrition_data["overall_stats"]}
+    for category, bucket in nutrition_data["calorie_distribution"].items():
+        yield {"section": "calorie_distribution", "category": category, **bucket}
+    for sample, recipes in nutrition_data["sample_recipes"].items():
+        for recipe in recipes:
+            yield {"section": sample, **recipe}
+
+
+def _sentiment_records(sentiment_data: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    summary = {k: v for k, v in sentiment_data.items() if k != "sample_reviews"}
+    yield {"section": "summary", **summary}
+    for review in sentiment_data["sample_reviews"]:
+        yield {"section": "review", "recipe_name": sentiment_data["recipe_name"], **review}
+
+
+def _facet_records(result: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    for hit in result["hits"]:
+        yield {"section": "hit", **hit}
+    for facet, rows in result["facets"].items():
+        for row in rows:
+            yield {"section": "facet", "facet": facet, **row}
+
+
+def _single_record(result: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    return [result]
+
+
+@_formatter(_trend_records)
 def format_trend_output(trend_data: Dict[str, Any]) -> None:
     """Format and print trend analysis results with improved readability"""
 
@@ -27,6 +192,7 @@ def format_trend_output(trend_data: Dict[str, Any]) -> None:
                 print(f"{i}. {recipe['name']}")
                 print(f"   Rating: {recipe['rating']:.1f} ★ ({recipe['reviews']} reviews)")
 
+@_formatter(_nutrition_records)
 def format_nutrition_analysis(nutrition_data: Dict[str, Any]) -> None:
     """Format and print nutritional analysis results"""
     if not nutrition_data["overall_stats"]:
@@ -50,6 +216,7 @@ def format_nutrition_analysis(nutrition_data: Dict[str, Any]) -> None:
         print(f"Calories: {recipe['nutrition']['calories']}")
         print(f"Rating: {recipe['avg_rating']:.1f}")
 
+@_formatter(lambda recipes: recipes, RECIPE_CSV_FIELDS)
 def format_recipe_output(recipes: List[Dict[str, Any]], query_type: str) -> None:
     if not recipes:
         print(f"\nNo recipes found for {query_type}")
@@ -81,6 +248,12 @@ def format_recipe_output(recipes: List[Dict[str, Any]], query_type: str) -> None
         if 'avg_rating' in recipe:
             print(f"Rating: {recipe.get('avg_rating', 0):.1f}")
 
+        if 'review_count' in recipe:
+            print(f"Reviews: {recipe['review_count']}")
+
+        if 'score' in recipe and 'review_count' in recipe:
+            print(f"Confidence-Adjusted Rating: {recipe['score']:.2f}")
+
         if 'ingredients' in recipe:
             print("Ingredients:")
             # Format ingredients in a more readable way, 3 per line
@@ -102,12 +275,37 @@ def format_recipe_output(recipes: List[Dict[str, Any]], query_type: str) -> None
         if 'common_ingredients' in recipe:
             print(f"Common Ingredients: {recipe['common_ingredients']}")
 
+        if 'distance' in recipe:
+            print(f"Distance to Target: {recipe['distance']}")
+
+        if 'missing_ingredients' in recipe:
+            missing = recipe['missing_ingredients']
+            print(f"Missing Ingredients: {', '.join(missing) if missing else 'none'}")
+
         # Add tip for similar recipes - use original_id if available, otherwise use _id
         if 'original_id' in recipe:
             print(f"Tip: Use 'similar {recipe['original_id']}' to find similar recipes")
         elif '_id' in recipe:
             print(f"Tip: Use 'similar {recipe['_id']}' to find similar recipes")
 
+@_formatter(lambda reviews: reviews, REVIEW_CSV_FIELDS)
+def format_review_search_output(reviews: List[Dict[str, Any]], query_type: str) -> None:
+    if not reviews:
+        print(f"\nNo reviews found for {query_type}")
+        return
+
+    print(f"\nFound {len(reviews)} reviews:")
+    for review in reviews:
+        print("\n" + "-"*50)
+        print(f"Recipe: {review.get('recipe_name') or 'N/A'}")
+        if review.get('date'):
+            print(f"Date: {review['date']:%Y-%m-%d}")
+        if review.get('rating') is not None:
+            print(f"Rating: {review['rating']}")
+        if review.get('snippet'):
+            print(f"Review: {review['snippet']}")
+
+@_formatter(_sentiment_records)
 def format_sentiment_output(sentiment_data: Dict[str, Any]) -> None:
     if not sentiment_data:
         print("\nNo sentiment data available")
@@ -129,3 +327,59 @@ def format_sentiment_output(sentiment_data: Dict[str, Any]) -> None:
         print(f"Rating: {review['rating']}")
         print(f"Sentiment: {review['polarity']:.2f}")
         print(f"Review: {review['review']}")
+
+@_formatter(_single_record)
+def format_percentile_output(result: Dict[str, Any]) -> None:
+    if not result:
+        print("\nNo percentile data available")
+        return
+
+    segment = f" (recipes rated {result['min_rating']:g}+)" if result['min_rating'] else ""
+    print(f"\n{result['percentile']:g}th percentile of {result['nutrient']}{segment}: {result['value']:.1f}")
+    print(f"Rank error: ±{result['rank_error']:.1%} (99% confidence, {result['sample_size']} recipes)")
+
+@_formatter(_single_record)
+def format_distinct_output(result: Dict[str, Any]) -> None:
+    if not result:
+        print("\nNo reviewer data available")
+        return
+
+    if result['relative_error']:
+        print(f"\nDistinct reviewers for {result['label']}: ~{result['estimate']:.0f} "
+              f"(±{result['relative_error']:.1%} standard error)")
+    else:
+        print(f"\nDistinct reviewers for {result['label']}: {result['estimate']:.0f} (exact)")
+
+@_formatter(lambda result: result["ingredients"])
+def format_heavy_hitters_output(result: Dict[str, Any]) -> None:
+    if not result['ingredients']:
+        print("\nNo ingredient data available")
+        return
+
+    print(f"\nMost Common Ingredients (counts overestimate by at most {result['error_bound']}):")
+    for i, item in enumerate(result['ingredients'], 1):
+        print(f"{i}. {item['ingredient']}: {item['count']} recipes")
+
+@_formatter(lambda report: [{"method": name, **counts} for name, counts in report.items()])
+def format_degradation_output(report: Dict[str, Dict[str, Any]]) -> None:
+    if not report:
+        print("\nNo calls recorded yet")
+        return
+
+    print("\nDeadline degradations per method:")
+    for name, counts in report.items():
+        print(f"  {name:<36}{counts['degraded']:>5} of {counts['calls']:<6} ({counts['rate']:.1%})")
+
+@_formatter(_facet_records)
+def format_faceted_output(result: Dict[str, Any], query_type: str) -> None:
+    format_recipe_output.__wrapped__(result["hits"], query_type)
+    if result.get("total") is None:
+        return
+
+    print("\n" + "=" * 50)
+    print(f"Total matches: {result['total']}{' (cached)' if result.get('cached') else ''}")
+    for facet, rows in result["facets"].items():
+        if rows:
+            print(f"\n{facet.replace('_', ' ').title()}:")
+            for row in rows:
+                print(f"  {row['label']:<28}{row['count']:>8}")
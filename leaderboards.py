@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+# Bayesian average: every recipe starts with this many virtual reviews at the global mean
+PRIOR_WEIGHT = 10
+
+# Entries served per board, plus slack so incremental refreshes rarely evict a true top-N recipe
+LEADERBOARD_SIZE = 100
+LEADERBOARD_BUFFER = 25
+
+POPULAR_TAGS = 200
+
+GLOBAL_BOARD = "global"
+
+
+def board_key(tag: str = None) -> str:
+    return f"tag:{tag}" if tag else GLOBAL_BOARD
+
+
+def bayesian_score(avg_rating: float, review_count: int, prior_mean: float, prior_weight: int = PRIOR_WEIGHT) -> float:
+    """Shrink a recipe's average towards the global mean in proportion to how few reviews it has"""
+    return (prior_weight * prior_mean + avg_rating * review_count) / (prior_weight + review_count)
+
+
+def _score_expression(prior_mean: float) -> Dict[str, Any]:
+    return {"$divide": [
+        {"$add": [PRIOR_WEIGHT * prior_mean, {"$multiply": ["$avg_rating", "$review_count"]}]},
+        {"$add": [PRIOR_WEIGHT, "$review_count"]}
+    ]}
+
+
+ENTRY_FIELDS = {"recipe_id": "$_id", "original_id": "$original_id", "name": "$name",
+                "avg_rating": "$avg_rating", "review_count": "$review_count", "score": "$score"}
+
+
+def _entry(recipe: Dict[str, Any], score: float) -> Dict[str, Any]:
+    return {"recipe_id": recipe["_id"], "original_id": recipe.get("original_id"), "name": recipe.get("name"),
+            "avg_rating": recipe["avg_rating"], "review_count": recipe["review_count"], "score": score}
+
+
+def global_prior_mean(db) -> float:
+    result = list(db.reviews.aggregate([{"$group": {"_id": None, "mean": {"$avg": "$rating"}}}]))
+    return result[0]["mean"] if result else 0.0
+
+
+def build_leaderboards(db) -> None:
+    """Materialise the global board and one board per popular tag"""
+    print("Building leaderboards...")
+    prior_mean = global_prior_mean(db)
+    size = LEADERBOARD_SIZE + LEADERBOARD_BUFFER
+    rated = [
+        {"$match": {"review_count": {"$gte": 1}, "avg_rating": {"$exists": True}}},
+        {"$addFields": {"score": _score_expression(prior_mean)}}
+    ]
+
+    popular_tags = [t["_id"] for t in db.recipes.aggregate([
+        {"$unwind": "$tags"},
+        {"$sortByCount": "$tags"},
+        {"$limit": POPULAR_TAGS}
+    ], allowDiskUse=True)]
+
+    boards = [{"_id": GLOBAL_BOARD, "tag": None, "entries": list(db.recipes.aggregate(rated + [
+        {"$sort": {"score": -1}},
+        {"$limit": size},
+        {"$project": {"_id": 0, **ENTRY_FIELDS}}
+    ], allowDiskUse=True))}]
+    boards += [{"_id": board_key(b["_id"]), "tag": b["_id"], "entries": b["entries"]}
+               for b in db.recipes.aggregate(rated + [
+                   {"$unwind": "$tags"},
+                   {"$match": {"tags": {"$in": popular_tags}}},
+                   {"$group": {"_id": "$tags", "entries": {"$topN": {
+                       "n": size, "sortBy": {"score": -1}, "output": ENTRY_FIELDS
+                   }}}}
+               ], allowDiskUse=True)]
+
+    now = datetime.now()
+    for board in boards:
+        board.update({"prior_mean": prior_mean, "prior_weight": PRIOR_WEIGHT, "updated_at": now})
+    db.leaderboards.drop()
+    db.leaderboards.insert_many(boards)
+    print(f"Built {len(boards)} leaderboards (prior mean {prior_mean:.2f}, weight {PRIOR_WEIGHT})")
+
+
+def refresh_recipes(db, recipe_ids: Iterable[Any]) -> None:
+    """Re-score recipes whose stats changed and splice them into every board they belong to.
+
+    Each recipe costs one ``update_many`` across its boards: the old entry is
+    filtered out, the new one appended, and the array re-sorted and trimmed on
+    the server. The prior mean is kept from the last full build.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    board = db.leaderboards.find_one({"_id": GLOBAL_BOARD}, {"prior_mean": 1})
+    if board is None:
+        return
+    size = LEADERBOARD_SIZE + LEADERBOARD_BUFFER
+    recipes = db.recipes.find(
+        {"_id": {"$in": recipe_ids}, "review_count": {"$gte": 1}},
+        {"name": 1, "original_id": 1, "avg_rating": 1, "review_count": 1, "tags": 1}
+    )
+    for recipe in recipes:
+        entry = _entry(recipe, bayesian_score(recipe["avg_rating"], recipe["review_count"], board["prior_mean"]))
+        keys = [GLOBAL_BOARD] + [board_key(t) for t in recipe.get("tags", [])]
+        db.leaderboards.update_many({"_id": {"$in": keys}}, [
+            {"$set": {
+                "entries": {"$slice": [
+                    {"$sortArray": {
+                        "input": {"$concatArrays": [
+                            {"$filter": {"input": "$entries", "cond": {"$ne": ["$$this.recipe_id", recipe["_id"]]}}},
+                            [{"$literal": entry}]
+                        ]},
+                        "sortBy": {"score": -1}
+                    }},
+                    size
+                ]},
+                "updated_at": datetime.now()
+            }}
+        ])
+
+
+def top_entries(db, tag: str = None, limit: int = 5) -> List[Dict[str, Any]]:
+    """Top ``limit`` entries of a board in one document read; None when the board doesn't exist.
+
+    Boards only serve LEADERBOARD_SIZE entries, so a longer list is scored
+    live over the recipes with the board's prior mean, in the same order.
+    """
+    if limit <= LEADERBOARD_SIZE:
+        board = db.leaderboards.find_one({"_id": board_key(tag)}, {"entries": {"$slice": limit}})
+        return board["entries"] if board else None
+
+    board = db.leaderboards.find_one({"_id": board_key(tag)}, {"prior_mean": 1})
+    if board is None:
+        return None
+    match = {"review_count": {"$gte": 1}, "avg_rating": {"$exists": True}}
+    if tag:
+        match["tags"] = tag
+    return list(db.recipes.aggregate([
+        {"$match": match},
+        {"$addFields": {"score": _score_expression(board["prior_mean"])}},
+        {"$sort": {"score": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, **ENTRY_FIELDS}}
+    ], allowDiskUse=True))
@@ -0,0 +1,55 @@
+from typing import Any, Dict, Iterator, Mapping, Tuple
+
+
+class _Result:
+    """Slotted result row with dict-style access, so formatters take it in place of a dict.
+
+    Only the fields listed in ``FIELDS`` are kept; fields absent from the
+    source document behave like missing keys.
+    """
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_document(cls, doc: Mapping[str, Any]) -> "_Result":
+        row = cls.__new__(cls)
+        for key in cls.FIELDS:
+            if key in doc:
+                setattr(row, key, doc[key])
+        return row
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS and hasattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def keys(self) -> Iterator[str]:
+        return (key for key in self.FIELDS if hasattr(self, key))
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return ((key, getattr(self, key)) for key in self.keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Review(_Result):
+    FIELDS = ("_id", "recipe_id", "recipe_name", "user_id", "date", "rating", "review", "snippet", "score")
+    __slots__ = FIELDS
@@ -0,0 +1,183 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from query_planner import NUTRIENTS
+from search_index import DEFAULT_INDEX_DIR
+
+NUTRITION_INDEX_PATH = os.path.join(DEFAULT_INDEX_DIR, "nutrition")
+
+# Each dimension is divided by its 10th-90th percentile spread, so "100 kcal off" and
+# "10 %DV protein off" weigh about the same and outliers don't dominate the scale
+SCALE_PERCENTILES = (10, 90)
+
+# Targets for "low"/"high" in place of a number, as percentiles of that nutrient
+LOW_HIGH_PERCENTILES = {"low": 5, "high": 95}
+
+
+@dataclass
+class MacroQuery:
+    """Weighted nutrition targets plus optional hard ranges and a minimum rating"""
+    targets: Dict[str, float] = field(default_factory=dict)
+    weights: Dict[str, float] = field(default_factory=dict)
+    ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = field(default_factory=dict)
+    relative: Dict[str, str] = field(default_factory=dict)
+    min_rating: Optional[float] = None
+
+    _CONDITION_RE = re.compile(r"^([a-z_]+)(<=|>=|=)([a-z0-9.]+)(?:\*([0-9.]+))?$")
+
+    @classmethod
+    def parse(cls, args: List[str]) -> "MacroQuery":
+        """Parse CLI arguments such as ``calories=600 protein=80*2 sodium=low total_fat<=30 rating>=4``.
+
+        ``nutrient=value`` sets a target (``low``/``high`` for the extremes), an
+        optional ``*w`` its weight, and ``<=``/``>=`` a hard range. Ranges alone
+        (``sodium<=20 protein>=30``) are fine; those matches are ranked by rating.
+        Values are in the dataset's units: kcal for calories, % daily value
+        otherwise. Raises ValueError on malformed arguments.
+        """
+        query = cls()
+        for arg in args:
+            match = cls._CONDITION_RE.match(arg.lower())
+            if not match:
+                raise ValueError(f"Unsupported condition '{arg}'")
+            key, op, value, weight = match.groups()
+            if key == "rating" and op == ">=":
+                query.min_rating = float(value)
+                continue
+            if key not in NUTRIENTS:
+                raise ValueError(f"Unknown nutrient '{key}'. Options: {', '.join(NUTRIENTS)}")
+            if op == "=":
+                if value in LOW_HIGH_PERCENTILES:
+                    query.relative[key] = value
+                else:
+                    query.targets[key] = float(value)
+                query.weights[key] = float(weight) if weight else 1.0
+            else:
+                low, high = query.ranges.get(key, (None, None))
+                if op == "<=":
+                    high = float(value)
+                else:
+                    low = float(value)
+                query.ranges[key] = (low, high)
+        if not (query.targets or query.relative or query.ranges or query.min_rating is not None):
+            raise ValueError("Give at least one target or range, e.g. calories=600 or sodium<=20")
+        return query
+
+
+class NutritionIndex:
+    """Column-major float32 matrix of every recipe's 7 nutrition values.
+
+    A query computes the weighted, scale-normalised squared distance to the
+    targets for all recipes passing the range/rating masks in a handful of
+    vectorised passes (one per targeted nutrient), then takes the top k with
+    ``argpartition``. Over ~230k recipes that is a few milliseconds, so no
+    tree is needed.
+    """
+
+    def __init__(self, values: np.ndarray, scales: np.ndarray, original_ids: np.ndarray, ratings: np.ndarray):
+        self.values = values  # (len(NUTRIENTS), n_recipes)
+        self.scales = scales
+        self.original_ids = original_ids
+        self.ratings = ratings
+        self.dimensions = {n: i for i, n in enumerate(NUTRIENTS)}
+
+    @classmethod
+    def build(cls, recipes: Iterable[Dict[str, Any]]) -> "NutritionIndex":
+        rows, original_ids, ratings = [], [], []
+        for recipe in recipes:
+            nutrition = recipe.get("nutrition") or {}
+            if any(nutrition.get(n) is None for n in NUTRIENTS):
+                continue
+            rows.append([nutrition[n] for n in NUTRIENTS])
+            original_ids.append(int(recipe["original_id"]))
+            rating = recipe.get("avg_rating")
+            ratings.append(rating if rating is not None else np.nan)
+
+        values = np.ascontiguousarray(np.asarray(rows, dtype=np.float32).reshape(-1, len(NUTRIENTS)).T)
+        low, high = (np.percentile(values, SCALE_PERCENTILES, axis=1) if values.shape[1]
+                     else (np.zeros(len(NUTRIENTS)), np.ones(len(NUTRIENTS))))
+        scales = np.maximum(high - low, 1e-6).astype(np.float32)
+        return cls(values, scales, np.asarray(original_ids, dtype=np.int64), np.asarray(ratings, dtype=np.float32))
+
+    def save(self, path: str = NUTRITION_INDEX_PATH) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "nutrients.json"), "w") as f:
+            json.dump(list(NUTRIENTS), f)
+        np.savez(os.path.join(path, "nutrition.npz"), values=self.values, scales=self.scales,
+                 original_ids=self.original_ids, ratings=self.ratings)
+
+    @classmethod
+    def load(cls, path: str = NUTRITION_INDEX_PATH) -> Optional["NutritionIndex"]:
+        if not os.path.exists(os.path.join(path, "nutrition.npz")):
+            return None
+        with open(os.path.join(path, "nutrients.json")) as f:
+            if tuple(json.load(f)) != NUTRIENTS:
+                return None  # built for a different layout; rebuild with data-creation.py
+        data = np.load(os.path.join(path, "nutrition.npz"))
+        return cls(data["values"], data["scales"], data["original_ids"], data["ratings"])
+
+    def resolve_targets(self, query: MacroQuery) -> Dict[str, float]:
+        """Numeric targets, with low/high turned into percentiles of the nutrient"""
+        targets = dict(query.targets)
+        for nutrient, level in query.relative.items():
+            column = self.values[self.dimensions[nutrient]]
+            targets[nutrient] = float(np.percentile(column, LOW_HIGH_PERCENTILES[level])) if len(column) else 0.0
+        return targets
+
+    def candidates(self, query: MacroQuery) -> np.ndarray:
+        """Row numbers passing every hard range and the rating floor"""
+        mask = np.ones(len(self.original_ids), dtype=bool)
+        for nutrient, (low, high) in query.ranges.items():
+            column = self.values[self.dimensions[nutrient]]
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+        if query.min_rating is not None:
+            mask &= self.ratings >= query.min_rating  # NaN (unrated) compares False
+        return np.flatnonzero(mask)
+
+    def search(self, query: MacroQuery, limit: int = 5) -> List[Dict[str, Any]]:
+        """The ``limit`` recipes closest to the targets, as ``original_id``/``distance``/``nutrition``.
+
+        Without targets the matches are the best-rated ones (unrated last) and
+        ``distance`` is None.
+        """
+        rows = self.candidates(query)
+        if not len(rows):
+            return []
+        targets = self.resolve_targets(query)
+        if targets:
+            key = np.zeros(len(rows), dtype=np.float32)
+            for nutrient, target in targets.items():
+                dim = self.dimensions[nutrient]
+                diff = (self.values[dim, rows] - np.float32(target)) / self.scales[dim]
+                key += np.float32(query.weights.get(nutrient, 1.0)) * diff * diff
+        else:
+            key = -np.nan_to_num(self.ratings[rows], nan=-1.0)
+
+        if len(rows) > limit:
+            top = np.argpartition(key, limit)[:limit]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(key[top], kind="stable")]
+        return [{
+            "original_id": int(self.original_ids[rows[i]]),
+            "distance": float(np.sqrt(key[i])) if targets else None,
+            "nutrition": {n: round(float(self.values[d, rows[i]]), 1) for n, d in self.dimensions.items()}
+        } for i in top]
+
+
+def build_nutrition_index(db, path: str = NUTRITION_INDEX_PATH) -> NutritionIndex:
+    """Collect every recipe's nutrition vector and persist the index"""
+    print("Building nutrition index...")
+    cursor = db.recipes.find({}, {"original_id": 1, "nutrition": 1, "avg_rating": 1, "_id": 0}, batch_size=5000)
+    index = NutritionIndex.build(cursor)
+    index.save(path)
+    print(f"Indexed nutrition vectors of {len(index.original_ids)} recipes into {path}")
+    return index
@@ -0,0 +1,177 @@
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from autocomplete import normalize
+from search_index import DEFAULT_INDEX_DIR
+
+PANTRY_INDEX_PATH = os.path.join(DEFAULT_INDEX_DIR, "pantry")
+
+# Ingredients that get a dense bit; the dictionary is frequency ordered so these
+# cover the vast majority of ingredient occurrences. Rarer ones live in a CSR tail.
+DENSE_BITS = 1024
+
+# Assumed to be in every kitchen unless the caller opts out
+STAPLES = ("salt", "water", "pepper", "black pepper")
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        """Set bits per column of a ``(n_words, n_recipes)`` uint64 matrix"""
+        return np.bitwise_count(words).sum(axis=0, dtype=np.int32)
+else:  # numpy < 2.0
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        """Set bits per column of a ``(n_words, n_recipes)`` uint64 matrix"""
+        as_bytes = words.view(np.uint8).reshape(words.shape[0], words.shape[1], 8)
+        return _BYTE_COUNTS[as_bytes].sum(axis=(0, 2), dtype=np.int32)
+
+
+class PantryIndex:
+    """Bitset encoding of every recipe's ingredient set over an ingredient dictionary.
+
+    A recipe is makeable from a pantry when ``recipe & ~pantry`` is empty. Its
+    missing count is its ingredient count minus ``popcount(recipe & pantry)``, and
+    only the uint64 columns where the pantry has bits set need to be touched, so
+    a typical pantry reads a handful of rows of the word-major
+    ``(DENSE_BITS // 64, n_recipes)`` matrix, each one contiguous in memory. Ingredients beyond the first ``DENSE_BITS`` dictionary entries are rare,
+    so they are kept as CSR lists and only touched when the pantry contains one.
+    """
+
+    def __init__(self, vocabulary: List[str], dense, tail_offsets, tail_ids, original_ids, ratings):
+        self.vocabulary = vocabulary
+        self.ingredient_ids = {name: i for i, name in enumerate(vocabulary)}
+        self.dense = dense
+        self.tail_offsets = tail_offsets
+        self.tail_ids = tail_ids
+        self.tail_counts = np.diff(tail_offsets).astype(np.int32)
+        self.ingredient_counts = _popcount(dense) + self.tail_counts
+        self.original_ids = original_ids
+        self.ratings = ratings
+
+    @property
+    def words(self) -> int:
+        return self.dense.shape[0]
+
+    @classmethod
+    def build(cls, recipes: Iterable[Dict[str, Any]], dense_bits: int = DENSE_BITS) -> "PantryIndex":
+        recipes = [(int(r["original_id"]), r.get("avg_rating"), sorted({normalize(i) for i in r.get("ingredients", [])}))
+                   for r in recipes]
+        counts: Dict[str, int] = {}
+        for _, _, ingredients in recipes:
+            for ingredient in ingredients:
+                counts[ingredient] = counts.get(ingredient, 0) + 1
+        vocabulary = sorted(counts, key=lambda i: (-counts[i], i))
+        lookup = {name: i for i, name in enumerate(vocabulary)}
+
+        words = dense_bits // 64
+        dense = np.zeros((words, len(recipes)), dtype=np.uint64)
+        tail_offsets = np.zeros(len(recipes) + 1, dtype=np.int64)
+        tail_ids = []
+        for row, (_, _, ingredients) in enumerate(recipes):
+            ids = np.fromiter((lookup[i] for i in ingredients), dtype=np.int64, count=len(ingredients))
+            head = ids[ids < dense_bits]
+            np.bitwise_or.at(dense[:, row], head // 64, np.left_shift(np.uint64(1), (head % 64).astype(np.uint64)))
+            tail = ids[ids >= dense_bits]
+            tail_ids.extend(tail.tolist())
+            tail_offsets[row + 1] = tail_offsets[row] + len(tail)
+
+        ratings = np.array([r if r is not None else np.nan for _, r, _ in recipes], dtype=np.float32)
+        return cls(vocabulary, dense, tail_offsets, np.asarray(tail_ids, dtype=np.int32),
+                   np.array([o for o, _, _ in recipes], dtype=np.int64), ratings)
+
+    def save(self, path: str = PANTRY_INDEX_PATH) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump(self.vocabulary, f)
+        np.savez(os.path.join(path, "pantry.npz"), dense=self.dense, tail_offsets=self.tail_offsets,
+                 tail_ids=self.tail_ids, original_ids=self.original_ids, ratings=self.ratings)
+
+    @classmethod
+    def load(cls, path: str = PANTRY_INDEX_PATH) -> Optional["PantryIndex"]:
+        if not os.path.exists(os.path.join(path, "pantry.npz")):
+            return None
+        with open(os.path.join(path, "vocabulary.json")) as f:
+            vocabulary = json.load(f)
+        data = np.load(os.path.join(path, "pantry.npz"))
+        return cls(vocabulary, data["dense"], data["tail_offsets"], data["tail_ids"],
+                   data["original_ids"], data["ratings"])
+
+    def resolve(self, ingredient: str) -> Optional[int]:
+        """Dictionary id for a typed ingredient, tolerating simple plural differences"""
+        key = normalize(ingredient)
+        for candidate in (key, key + "s", key[:-1] if key.endswith("s") else None, key + "es"):
+            if candidate and candidate in self.ingredient_ids:
+                return self.ingredient_ids[candidate]
+        return None
+
+    def missing_counts(self, pantry_ids: Iterable[int]) -> np.ndarray:
+        pantry_ids = np.unique(np.asarray(list(pantry_ids), dtype=np.int64))
+        dense_bits = self.words * 64
+        mask = np.zeros(self.words, dtype=np.uint64)
+        head = pantry_ids[pantry_ids < dense_bits]
+        np.bitwise_or.at(mask, head // 64, np.left_shift(np.uint64(1), (head % 64).astype(np.uint64)))
+
+        words = np.flatnonzero(mask)
+        missing = self.ingredient_counts.copy()
+        if len(words):
+            missing -= _popcount(self.dense[words] & mask[words, None])
+        tail = pantry_ids[pantry_ids >= dense_bits]
+        if len(tail) and len(self.tail_ids):
+            # Subtract the pantry's rare ingredients from each recipe's tail count
+            hits = np.isin(self.tail_ids, tail).astype(np.int32)
+            hit_counts = np.add.reduceat(np.append(hits, 0), self.tail_offsets[:-1])
+            missing -= np.where(self.tail_counts > 0, hit_counts, 0).astype(np.int32)
+        return missing
+
+    def ingredients_of(self, row: int) -> List[str]:
+        bits = np.unpackbits(np.ascontiguousarray(self.dense[:, row]).view(np.uint8), bitorder="little")
+        ids = np.flatnonzero(bits).tolist()
+        ids += self.tail_ids[self.tail_offsets[row]:self.tail_offsets[row + 1]].tolist()
+        return [self.vocabulary[i] for i in ids]
+
+    def search(self, ingredients: Iterable[str], max_missing: int = 0, limit: int = 5,
+               assume_staples: bool = True) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Rank recipes by missing-ingredient count, then rating.
+
+        Returns ``(matches, unknown)`` where each match carries ``original_id``,
+        ``missing_count`` and ``missing`` ingredient names, and ``unknown`` lists
+        pantry items not found in the dictionary.
+        """
+        ingredients = list(ingredients) + (list(STAPLES) if assume_staples else [])
+        pantry_ids, unknown = [], []
+        for ingredient in ingredients:
+            ingredient_id = self.resolve(ingredient)
+            if ingredient_id is None:
+                if ingredient not in STAPLES:
+                    unknown.append(ingredient)
+            else:
+                pantry_ids.append(ingredient_id)
+
+        missing = self.missing_counts(pantry_ids)
+        candidates = np.flatnonzero(missing <= max_missing)
+        if not len(candidates):
+            return [], unknown
+        ratings = np.nan_to_num(self.ratings[candidates], nan=0.0)
+        order = np.lexsort((-ratings, missing[candidates]))[:limit]
+        pantry = set(pantry_ids)
+        matches = []
+        for row in candidates[order]:
+            missing_names = [i for i in self.ingredients_of(row) if self.ingredient_ids[i] not in pantry]
+            matches.append({"original_id": int(self.original_ids[row]),
+                            "missing_count": int(missing[row]),
+                            "missing": missing_names})
+        return matches, unknown
+
+
+def build_pantry_index(db, path: str = PANTRY_INDEX_PATH) -> PantryIndex:
+    """Encode every recipe's ingredients as a bitset and persist the index"""
+    print("Building pantry index...")
+    cursor = db.recipes.find({}, {"original_id": 1, "ingredients": 1, "avg_rating": 1, "_id": 0},
+                             batch_size=5000)
+    index = PantryIndex.build(cursor)
+    index.save(path)
+    print(f"Encoded {len(index.original_ids)} recipes over {len(index.vocabulary)} ingredients into {path}")
+    return index
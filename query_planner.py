@@ -0,0 +1,312 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from search_index import DEFAULT_INDEX_DIR, tokenize
+
+QUERY_STATS_PATH = os.path.join(DEFAULT_INDEX_DIR, "query_stats.json")
+
+NUTRIENTS = ("calories", "total_fat", "sugar", "sodium", "protein", "saturated_fat", "carbohydrates")
+
+DIET_KEYWORDS = {
+    'vegetarian': ['vegetarian', '-chicken', '-beef', '-pork', '-fish'],
+    'vegan': ['vegan', '-meat', '-egg', '-dairy', '-cheese'],
+    'gluten-free': ['gluten-free', '-wheat', '-flour'],
+    'keto': ['keto', 'low-carb'],
+    'paleo': ['paleo', '-grain', '-dairy'],
+    'dairy-free': ['dairy-free', '-milk', '-cheese', '-cream']
+}
+
+# Fallback selectivities used when no statistics have been collected yet
+DEFAULT_SELECTIVITY = {"text": 0.05, "range": 0.33, "cuisine": 0.1, "diet": 0.2, "rating": 0.3}
+
+# Recipes first pulled from the in-process search index when text drives a query; the
+# cap grows by TEXT_CANDIDATES_GROWTH until the limit is filled or the matches run out
+TEXT_CANDIDATES = 1000
+TEXT_CANDIDATES_GROWTH = 4
+
+RESULT_PROJECTION = {"name": 1, "original_id": 1, "minutes": 1, "avg_rating": 1,
+                     "nutrition": 1, "ingredients": 1}
+
+
+def diet_filter(restriction: str) -> Optional[Dict[str, Any]]:
+    """Translate a dietary restriction into a Mongo filter, or None if unknown"""
+    restriction = restriction.lower()
+    if restriction not in DIET_KEYWORDS:
+        return None
+
+    query = {"$and": []}
+
+    # Add positive keywords
+    positive_terms = [kw for kw in DIET_KEYWORDS[restriction] if not kw.startswith('-')]
+    if positive_terms:
+        query["$and"].append({"tags": {"$in": positive_terms}})
+
+    # Add negative keywords
+    negative_terms = [kw[1:] for kw in DIET_KEYWORDS[restriction] if kw.startswith('-')]
+    if negative_terms:
+        for term in negative_terms:
+            query["$and"].append({
+                "$and": [
+                    {"ingredients": {"$not": {"$regex": term, "$options": "i"}}},
+                    {"tags": {"$not": {"$regex": term, "$options": "i"}}}
+                ]
+            })
+    return query
+
+
+@dataclass
+class RecipeQuery:
+    """Any mix of criteria; unset fields are simply not applied"""
+    text: Optional[str] = None
+    max_minutes: Optional[int] = None
+    nutrients: Dict[str, Tuple[Optional[float], Optional[float]]] = field(default_factory=dict)
+    cuisine: Optional[str] = None
+    diet: Optional[str] = None
+    min_rating: Optional[float] = None
+
+    _CONDITION_RE = re.compile(r"^([a-z_]+)(<=|>=|=)(.+)$")
+
+    @classmethod
+    def parse(cls, args: List[str]) -> "RecipeQuery":
+        """Parse CLI arguments such as ``chicken time<=30 calories<=500 diet=gluten-free``.
+
+        Bare words become the text query. Raises ValueError on malformed conditions.
+        """
+        query = cls()
+        words = []
+        for arg in args:
+            match = cls._CONDITION_RE.match(arg.lower())
+            if not match:
+                words.append(arg)
+                continue
+            key, op, value = match.groups()
+            if key in ("time", "minutes") and op == "<=":
+                query.max_minutes = int(value)
+            elif key == "rating" and op == ">=":
+                query.min_rating = float(value)
+            elif key == "cuisine" and op == "=":
+                query.cuisine = value
+            elif key == "diet" and op == "=":
+                if value not in DIET_KEYWORDS:
+                    raise ValueError(f"Unknown diet '{value}'. Options: {', '.join(DIET_KEYWORDS)}")
+                query.diet = value
+            elif key in NUTRIENTS and op in ("<=", ">="):
+                low, high = query.nutrients.get(key, (None, None))
+                if op == "<=":
+                    high = float(value)
+                else:
+                    low = float(value)
+                query.nutrients[key] = (low, high)
+            else:
+                raise ValueError(f"Unsupported condition '{arg}'")
+        if words:
+            query.text = " ".join(words)
+        return query
+
+    def is_empty(self) -> bool:
+        return not (self.text or self.max_minutes is not None or self.nutrients or self.cuisine
+                    or self.diet or self.min_rating is not None)
+
+
+class QueryStats:
+    """Per-field percentile tables and tag counts used for selectivity estimates"""
+
+    def __init__(self, total: int, percentiles: Dict[str, List[float]], tag_counts: Dict[str, int]):
+        self.total = total
+        self.percentiles = {k: np.asarray(v, dtype=np.float64) for k, v in percentiles.items()}
+        self.tag_counts = tag_counts
+
+    @classmethod
+    def load(cls, path: str = QUERY_STATS_PATH) -> Optional["QueryStats"]:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["total"], data["percentiles"], data["tag_counts"])
+
+    def save(self, path: str = QUERY_STATS_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"total": self.total,
+                       "percentiles": {k: v.tolist() for k, v in self.percentiles.items()},
+                       "tag_counts": self.tag_counts}, f)
+
+    def _cdf(self, name: str, value: float) -> float:
+        table = self.percentiles[name]
+        # Interpolate the value's position within the 0..100 percentile table
+        return float(np.interp(value, table, np.linspace(0.0, 1.0, len(table))))
+
+    def range_selectivity(self, name: str, low: Optional[float], high: Optional[float]) -> Optional[float]:
+        if name not in self.percentiles:
+            return None
+        upper = self._cdf(name, high) if high is not None else 1.0
+        lower = self._cdf(name, low) if low is not None else 0.0
+        return max(upper - lower, 0.0)
+
+    def matching_tags(self, fragment: str) -> List[str]:
+        fragment = fragment.lower()
+        return [tag for tag in self.tag_counts if fragment in tag]
+
+    def tags_selectivity(self, tags: List[str]) -> float:
+        if not self.total:
+            return 0.0
+        return min(sum(self.tag_counts.get(t, 0) for t in tags) / self.total, 1.0)
+
+
+def build_query_stats(db, path: str = QUERY_STATS_PATH) -> QueryStats:
+    """Collect the statistics the planner uses to order predicates"""
+    print("Collecting query planner statistics...")
+    values: Dict[str, List[float]] = {"minutes": [], "avg_rating": []}
+    values.update({n: [] for n in NUTRIENTS})
+    tag_counts: Dict[str, int] = {}
+    total = 0
+    for recipe in db.recipes.find({}, {"minutes": 1, "avg_rating": 1, "nutrition": 1, "tags": 1, "_id": 0},
+                                  batch_size=5000):
+        total += 1
+        for key in ("minutes", "avg_rating"):
+            if recipe.get(key) is not None:
+                values[key].append(recipe[key])
+        for nutrient, value in (recipe.get("nutrition") or {}).items():
+            if nutrient in values and value is not None:
+                values[nutrient].append(value)
+        for tag in recipe.get("tags", []):
+            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+
+    percentiles = {k: np.percentile(np.asarray(v, dtype=np.float64), np.arange(101))
+                   for k, v in values.items() if v}
+    stats = QueryStats(total, percentiles, tag_counts)
+    stats.save(path)
+    print(f"Saved statistics for {total} recipes to {path}")
+    return stats
+
+
+@dataclass
+class Predicate:
+    name: str
+    filter: Optional[Dict[str, Any]]  # None for text served by the in-process index (IDs resolved at run time)
+    selectivity: float
+    index: Optional[str] = None  # Mongo index that can drive this predicate, if any
+
+
+class QueryPlanner:
+    """Orders a RecipeQuery's predicates by estimated selectivity and runs it as one query.
+
+    The most selective indexable predicate drives the scan (via ``hint`` or the
+    in-process search index); every other predicate, the rating sort and the
+    limit are pushed into that same Mongo query. When the in-process index
+    serves the text but another predicate is more selective, the text matches
+    become an ``original_id`` filter on the driving query.
+    """
+
+    def __init__(self, db, stats: Optional[QueryStats] = None, search_index=None):
+        self.db = db
+        self.stats = stats
+        self.search_index = search_index
+
+    def _range(self, name: str, path: str, low, high, index: Optional[str]) -> Predicate:
+        condition = {}
+        if low is not None:
+            condition["$gte"] = low
+        if high is not None:
+            condition["$lte"] = high
+        estimate = self.stats.range_selectivity(name, low, high) if self.stats else None
+        return Predicate(name, {path: condition},
+                         DEFAULT_SELECTIVITY["range"] if estimate is None else estimate, index)
+
+    def predicates(self, query: RecipeQuery) -> List[Predicate]:
+        preds = []
+        if query.text:
+            if self.search_index is not None:
+                dfs = [max((s.df(t) for s in self.search_index.segments), default=0)
+                       for t in set(tokenize(query.text))]
+                selectivity = min(sum(dfs) / max(self.search_index.doc_count, 1), 1.0)
+                preds.append(Predicate("text", None, selectivity, "search_index"))
+            else:
+                preds.append(Predicate("text", {"$text": {"$search": query.text}},
+                                       DEFAULT_SELECTIVITY["text"], "text"))
+        if query.max_minutes is not None:
+            preds.append(self._range("minutes", "minutes", None, query.max_minutes, "minutes_1"))
+        for nutrient, (low, high) in query.nutrients.items():
+            index = "nutrition.calories_1" if nutrient == "calories" else None
+            preds.append(self._range(nutrient, f"nutrition.{nutrient}", low, high, index))
+        if query.min_rating is not None:
+            preds.append(self._range("avg_rating", "avg_rating", query.min_rating, None, "avg_rating_-1"))
+        if query.cuisine:
+            tags = self.stats.matching_tags(query.cuisine) if self.stats else []
+            if tags:
+                # Expanding the fragment to concrete tags lets the multikey tags index serve it
+                preds.append(Predicate("cuisine", {"tags": {"$in": tags}},
+                                       self.stats.tags_selectivity(tags), "tags_1"))
+            else:
+                preds.append(Predicate("cuisine", {"tags": {"$regex": re.escape(query.cuisine), "$options": "i"}},
+                                       DEFAULT_SELECTIVITY["cuisine"]))
+        if query.diet:
+            positive = [kw for kw in DIET_KEYWORDS[query.diet] if not kw.startswith('-')]
+            selectivity = self.stats.tags_selectivity(positive) if self.stats else DEFAULT_SELECTIVITY["diet"]
+            preds.append(Predicate("diet", diet_filter(query.diet), selectivity, "tags_1"))
+        return sorted(preds, key=lambda p: p.selectivity)
+
+    def explain(self, query: RecipeQuery) -> List[Dict[str, Any]]:
+        preds = self.predicates(query)
+        driver = self._driver(preds)
+        return [{"predicate": p.name, "selectivity": round(p.selectivity, 4),
+                 "index": p.index, "driver": p is driver} for p in preds]
+
+    def _driver(self, preds: List[Predicate]) -> Optional[Predicate]:
+        # $text must drive whenever present: Mongo only evaluates it through the text index.
+        # Text from the in-process index competes on selectivity like any other predicate.
+        if self.search_index is None:
+            for p in preds:
+                if p.name == "text":
+                    return p
+        return next((p for p in preds if p.index), None)
+
+    def execute(self, query: RecipeQuery, limit: int = 5, projection: Dict[str, Any] = None,
+                ranked: bool = True) -> List[Dict[str, Any]]:
+        """Run the plan; ``ranked=False`` skips the final sort and returns the first matches found"""
+        projection = projection or RESULT_PROJECTION
+        preds = self.predicates(query)
+        driver = self._driver(preds)
+        rest = [p.filter for p in preds if p is not driver and p.filter is not None]
+
+        if query.text and self.search_index is not None:
+            if driver.name == "text":
+                return self._execute_text_driven(query.text, rest, limit, projection, ranked)
+            # Another predicate drives; every text match (not just the top few) filters its scan
+            matches = self.search_index.search(query.text, max(self.search_index.doc_count, 1))
+            rest.append({"original_id": {"$in": [original_id for original_id, _ in matches]}})
+
+        if driver is not None and driver.name == "text":
+            conditions = [driver.filter] + rest
+            cursor = self.db.recipes.find({"$and": conditions}, {**projection, "score": {"$meta": "textScore"}})
+            if ranked:
+                cursor = cursor.sort([("score", {"$meta": "textScore"}), ("avg_rating", -1)])
+            return list(cursor.limit(limit))
+
+        conditions = ([driver.filter] if driver else []) + rest
+        cursor = self.db.recipes.find({"$and": conditions} if conditions else {}, projection)
+        if driver is not None and driver.index:
+            cursor = cursor.hint(driver.index)
+        if ranked:
+            cursor = cursor.sort("avg_rating", -1)
+        return list(cursor.limit(limit))
+
+    def _execute_text_driven(self, text: str, rest: List[Dict[str, Any]], limit: int,
+                             projection: Dict[str, Any], ranked: bool) -> List[Dict[str, Any]]:
+        """Filter the best BM25 candidates, widening the cap until ``limit`` rows pass or no matches are left"""
+        cap = TEXT_CANDIDATES
+        while True:
+            candidates = self.search_index.search(text, cap)
+            conditions = [{"original_id": {"$in": [original_id for original_id, _ in candidates]}}] + rest
+            cursor = self.db.recipes.find({"$and": conditions}, projection).hint("original_id_1")
+            if ranked:
+                cursor = cursor.sort("avg_rating", -1)
+            docs = list(cursor.limit(limit))
+            if len(docs) >= limit or len(candidates) < cap:
+                return docs
+            cap *= TEXT_CANDIDATES_GROWTH
@@ -1,9 +1,33 @@
 from pymongo import MongoClient
+from collections import Counter
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
 from textblob import TextBlob
+from search_index import SearchIndex
+from autocomplete import Autocomplete
+from dictionaries import load_dictionaries
+from sketches import (
+    NUTRIENTS, RATING_SEGMENTS, HEAVY_HITTERS_KEY, DistinctCounter, HyperLogLog, KLLSketch, SpaceSaving,
+    nutrition_key, record_reviews
+)
+from review_storage import (
+    add_review, bucketed_reviews, remove_review, seasonal_pipeline, trending_counters_pipeline, trending_pipeline
+)
+from taste_profiles import TOP_INGREDIENTS, TOP_TAGS, apply_rating, top_preferences
+from leaderboards import LEADERBOARD_SIZE, refresh_recipes, top_entries
+from pantry import PantryIndex
+from nutrition_index import MacroQuery, NutritionIndex
+from query_planner import TEXT_CANDIDATES, QueryPlanner, QueryStats, RecipeQuery, diet_filter
+from facets import FacetCache, facet_pipeline, format_facets
+from review_index import PHRASE_CANDIDATES, ReviewIndex, ReviewQuery, snippet
+from models import Review
+from deadlines import DEFAULT_DEADLINE, DeadlineStats, is_timeout, with_deadline
+import re
 import time
 
+# Candidates ranked by find_similar_recipes on its fallback path
+SIMILAR_FALLBACK_CANDIDATES = 500
+
 class RecipeApp:
     def __init__(self):
         # Add a small delay before connecting to MongoDB
@@ -16,28 +40,202 @@ class RecipeApp:
         except Exception as e:
             print(f"Failed to connect to MongoDB: {e}")
             raise
+        self._search_index = None
+        self._autocomplete = None
+        self._query_stats = None
+        self._pantry_index = None
+        self._nutrition_index = None
+        self._review_index = None
+        self._dictionaries = None
+        self._has_buckets = None
+        self._facet_cache = FacetCache()
+        # Set by the CLI for machine-readable output: finders called without a deadline then
+        # return the live cursor so rows are written as they arrive instead of being collected first
+        self.stream_results = False
+        # Every public method runs under a deadline (see deadlines.py); _fallback is set
+        # while a method re-runs on its cheaper path after the deadline ran out
+        self.default_deadline = DEFAULT_DEADLINE
+        self.deadline_stats = DeadlineStats()
+        self._deadline_at = None
+        self._fallback = False
+
+    def _results(self, cursor):
+        # A streamed cursor is consumed after the method returns, outside its deadline block,
+        # where a timeout could no longer fall back or be counted; so only stream unbounded calls
+        if self.stream_results and self._deadline_at == float("inf"):
+            return cursor
+        return list(cursor)
+
+    def _ranked(self, cursor, sort):
+        """Best matches first, or on the fallback path the first matches found: no sort means the scan stops at the limit"""
+        return self._results(cursor if self._fallback else cursor.sort(sort))
+
+    def degradation_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Calls and deadline-degraded calls per method since startup"""
+        return self.deadline_stats.report()
+
+    def _get_search_index(self):
+        # Loaded lazily; the arrays are memory-mapped so this is cheap after the first call
+        if self._search_index is None:
+            self._search_index = SearchIndex.load() or False
+        return self._search_index or None
+
+    def _get_dictionaries(self) -> Dict[str, Any]:
+        # Empty until data-creation.py has encoded ingredients and tags as integer IDs
+        if self._dictionaries is None:
+            self._dictionaries = load_dictionaries(self.db)
+        return self._dictionaries
+
+    def _list_fields(self):
+        """Ingredient and tag fields to match on: the ID arrays when available"""
+        if self._get_dictionaries():
+            return "ingredient_ids", "tag_ids"
+        return "ingredients", "tags"
+
+    def _has_review_buckets(self) -> bool:
+        if self._has_buckets is None:
+            self._has_buckets = self.db.review_buckets.estimated_document_count() > 0
+        return self._has_buckets
+
+    def _get_autocomplete(self):
+        if self._autocomplete is None:
+            self._autocomplete = Autocomplete.load() or False
+        return self._autocomplete or None
+
+    def _get_query_planner(self) -> QueryPlanner:
+        if self._query_stats is None:
+            self._query_stats = QueryStats.load() or False
+        return QueryPlanner(self.db, self._query_stats or None, self._get_search_index())
+
+    @with_deadline()
+    def find_recipes(self, query: RecipeQuery, limit: int = 5) -> List[Dict[str, Any]]:
+        """Combined search over any mix of text, time, nutrition, cuisine, diet and rating"""
+        if query.is_empty():
+            return []
+        return self._get_query_planner().execute(query, limit, ranked=not self._fallback)
+
+    @with_deadline()
+    def explain_query(self, query: RecipeQuery) -> List[Dict[str, Any]]:
+        """Predicates in evaluation order with their estimated selectivity"""
+        return self._get_query_planner().explain(query)
+
+    @with_deadline()
+    def find_by_pantry(self, ingredients: List[str], max_missing: int = 0,
+                       limit: int = 5) -> List[Dict[str, Any]]:
+        """Recipes makeable from the given ingredients, fewest missing first then by rating"""
+        if self._pantry_index is None:
+            self._pantry_index = PantryIndex.load() or False
+        if not self._pantry_index:
+            print("Pantry index has not been built yet. Run data-creation.py first.")
+            return []
+
+        matches, unknown = self._pantry_index.search(ingredients, max_missing, limit)
+        if unknown:
+            print(f"Unknown ingredients ignored: {', '.join(unknown)}")
+        if self._fallback:
+            # The index alone knows IDs and missing ingredients; skip fetching names and details
+            return [{"original_id": m["original_id"], "missing_ingredients": m["missing"]} for m in matches]
+        docs = {doc["original_id"]: doc for doc in self.db.recipes.find(
+            {"original_id": {"$in": [m["original_id"] for m in matches]}},
+            {"name": 1, "ingredients": 1, "avg_rating": 1, "minutes": 1, "original_id": 1}
+        )}
+        results = []
+        for match in matches:
+            doc = docs.get(match["original_id"])
+            if doc:
+                doc["missing_ingredients"] = match["missing"]
+                results.append(doc)
+        return results
+
+    @with_deadline()
+    def find_by_macros(self, query: MacroQuery, limit: int = 5) -> List[Dict[str, Any]]:
+        """Recipes nearest to weighted nutrition targets (best-rated if only ranges), within any ranges and rating floor"""
+        if self._nutrition_index is None:
+            self._nutrition_index = NutritionIndex.load() or False
+        if not self._nutrition_index:
+            print("Nutrition index has not been built yet. Run data-creation.py first.")
+            return []
+
+        matches = self._nutrition_index.search(query, limit)
+        if self._fallback:
+            return matches
+        docs = {doc["original_id"]: doc for doc in self.db.recipes.find(
+            {"original_id": {"$in": [m["original_id"] for m in matches]}},
+            {"name": 1, "nutrition": 1, "avg_rating": 1, "minutes": 1, "original_id": 1}
+        )}
+        results = []
+        for match in matches:
+            doc = docs.get(match["original_id"])
+            if doc:
+                if match["distance"] is not None:
+                    doc["distance"] = round(match["distance"], 3)
+                results.append(doc)
+        return results
+
+    @with_deadline()
+    def complete(self, prefix: str, kind: str = "all", limit: int = 10) -> List[str]:
+        """Frequency-ranked completions for recipe names and/or ingredients"""
+        autocomplete = self._get_autocomplete()
+        if autocomplete is None:
+            return []
+        return autocomplete.complete(prefix, kind, limit)
+
+    @with_deadline(empty=None, fallback=False)
+    def find_recipe_by_name(self, recipe_name: str, projection: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Resolve a typed recipe name without scanning the collection"""
+        autocomplete = self._get_autocomplete()
+        if autocomplete is not None:
+            original_id = autocomplete.resolve_name(recipe_name)
+            if original_id is None:
+                return None
+            return self.db.recipes.find_one({"original_id": original_id}, projection)
+
+        # No prefix index built yet: an anchored, case-sensitive prefix regex can still use the name index
+        words = recipe_name.lower().split()
+        if not words:
+            return None
+        pattern = "^" + r"\s+".join(re.escape(w) for w in words)
+        return self.db.recipes.find_one({"name": {"$regex": pattern}}, projection,
+                                        sort=[("review_count", -1)])
 
     def close(self):
         if hasattr(self, 'client'):
             self.client.close()
             
         #base function to return important information about a recipe
+    @with_deadline()
     def search_recipes(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        return list(self.db.recipes.find(
+        projection = {
+            "name": 1,
+            "ingredients": 1,
+            "avg_rating": 1,
+            "original_id": 1,
+            "_id": 1  # Explicitly include the _id field
+        }
+
+        index = self._get_search_index()
+        if index is not None:
+            # BM25 + rating ranking happens in-process, Mongo only fetches the winners
+            ranked = index.search(query, limit)
+            if self._fallback:
+                return [{"original_id": original_id, "score": score} for original_id, score in ranked]
+            docs = {doc["original_id"]: doc for doc in self.db.recipes.find(
+                {"original_id": {"$in": [original_id for original_id, _ in ranked]}},
+                projection
+            )}
+            return [docs[original_id] for original_id, _ in ranked if original_id in docs]
+
+        # Fallback to the Mongo text index, ordered by relevance instead of natural order
+        return self._ranked(self.db.recipes.find(
             {"$text": {"$search": query}},
-            {
-                "name": 1,
-                "ingredients": 1,
-                "avg_rating": 1,
-                "original_id": 1,
-                "_id": 1  # Explicitly include the _id field
-            }
-        ).limit(limit))
+            {**projection, "score": {"$meta": "textScore"}}
+        ).limit(limit), [("score", {"$meta": "textScore"})])
 
 #finding recipes by cooktime. We are limiting the responses to 5 so things dont get too crazy
 #searching my lte since we want our time and anything less. We sort to show the
+    @with_deadline()
     def find_by_cooking_time(self, minutes: int, limit: int = 5) -> List[Dict[str, Any]]:
-        return list(self.db.recipes.find(
+        return self._ranked(self.db.recipes.find(
             {"minutes": {"$lte": minutes}},
             {
                 "name": 1,
@@ -47,43 +245,120 @@ class RecipeApp:
                 "original_id": 1,
                 "ingredients": 1  # Including ingredients for better context
             }
-        ).sort([
+        ).limit(limit), [
             ("minutes", -1),  # Sort by minutes in descending order
             ("avg_rating", -1)  # Then by rating in descending order
-        ]).limit(limit))
+        ])
 #allows for searching a specific nutrion amount in the
-    def find_by_nutrition(self, nutrient: str, max_value: float, limit: int = 5) -> List[Dict[str, Any]]:
+    @with_deadline()
+    def find_by_nutrition(self, nutrient: str, max_value: float = None, limit: int = 5,
+                          percentile: float = None) -> List[Dict[str, Any]]:
+        """Recipes with ``nutrient`` at most ``max_value``, or at most its given percentile (0-100)"""
+        if percentile is not None:
+            cutoff = self.nutrient_percentile(nutrient, percentile)
+            if cutoff is None:
+                return []
+            max_value = cutoff["value"]
         query_field = f"nutrition.{nutrient}"
-        return list(self.db.recipes.find(
+        return self._ranked(self.db.recipes.find(
             {query_field: {"$lte": max_value}},
             {"name": 1, "nutrition": 1, "avg_rating": 1}
-        ).sort("avg_rating", -1).limit(limit))
+        ).limit(limit), [("avg_rating", -1)])
+
+    @with_deadline(empty=None, fallback=False)
+    def nutrient_percentile(self, nutrient: str, percentile: float, min_rating: float = 0.0) -> Dict[str, Any]:
+        """Approximate nutrient percentile from a precomputed KLL sketch (one document read)"""
+        if min_rating not in RATING_SEGMENTS:
+            raise ValueError(f"min_rating must be one of {', '.join(f'{r:g}' for r in RATING_SEGMENTS)}")
+        doc = self.db.sketches.find_one({"_id": nutrition_key(nutrient, min_rating)})
+        if not doc:
+            print(f"No quantile sketch for '{nutrient}'. Run data-creation.py to build sketches.")
+            return None
+        sketch = KLLSketch.from_doc(doc)
+        return {
+            "nutrient": nutrient,
+            "percentile": percentile,
+            "min_rating": min_rating,
+            "value": sketch.quantile(percentile / 100.0),
+            "rank_error": sketch.rank_error,
+            "sample_size": sketch.n
+        }
+
+    @with_deadline(empty=None, fallback=False)
+    def distinct_reviewers(self, recipe_id: str) -> Dict[str, Any]:
+        """Approximate distinct reviewers of one recipe (exact for small counts)"""
+        recipe = self.db.recipes.find_one({"original_id": int(recipe_id)}, {"name": 1})
+        if not recipe:
+            return None
+        doc = self.db.recipe_sketches.find_one({"_id": recipe["_id"]})
+        estimate, error = DistinctCounter.from_doc(doc["reviewers"]).estimate() if doc else (0.0, 0.0)
+        return {"label": recipe["name"], "estimate": estimate, "relative_error": error}
+
+    @with_deadline(empty=None, fallback=False)
+    def distinct_reviewers_by_month(self, month: str) -> Dict[str, Any]:
+        """Approximate distinct reviewers active in a ``YYYY-MM`` month"""
+        doc = self.db.sketches.find_one({"_id": f"reviewers:{month}"})
+        if not doc:
+            return {"label": month, "estimate": 0.0, "relative_error": 0.0}
+        hll = HyperLogLog.from_doc(doc)
+        return {"label": month, "estimate": hll.estimate(), "relative_error": hll.relative_error}
+
+    @with_deadline(empty=lambda: {"ingredients": [], "error_bound": 0}, fallback=False)
+    def top_ingredients(self, limit: int = 10) -> Dict[str, Any]:
+        """Most frequent ingredients from the heavy-hitter sketch"""
+        doc = self.db.sketches.find_one({"_id": HEAVY_HITTERS_KEY})
+        if not doc:
+            return {"ingredients": [], "error_bound": 0}
+        sketch = SpaceSaving.from_doc(doc)
+        return {
+            "ingredients": [{"ingredient": i, "count": c, "max_overcount": e} for i, c, e in sketch.top(limit)],
+            "error_bound": sketch.error_bound
+        }
 
+    def _cuisine_filter(self, cuisine: str) -> Dict[str, Any]:
+        dictionaries = self._get_dictionaries()
+        if dictionaries:
+            # Resolve the fragment against the small tag dictionary, then use the tag_ids index
+            return {"tag_ids": {"$in": dictionaries["tags"].matching(cuisine)}}
+        return {"tags": {"$regex": cuisine, "$options": "i"}}
+
+    @with_deadline()
     def find_by_cuisine(self, cuisine: str, limit: int = 5) -> List[Dict[str, Any]]:
-        return list(self.db.recipes.find(
-            {"tags": {"$regex": cuisine, "$options": "i"}},
+        return self._ranked(self.db.recipes.find(
+            self._cuisine_filter(cuisine),
             {"name": 1, "tags": 1, "avg_rating": 1, "ingredients": 1}
-        ).sort("avg_rating", -1).limit(limit))
+        ).limit(limit), [("avg_rating", -1)])
 
+    @with_deadline()
     def find_similar_recipes(self, recipe_id: str, limit: int = 5) -> List[Dict[str, Any]]:
         try:
+            if not recipe_id.strip().isdigit():
+                # Allow a recipe name in place of the numeric ID
+                recipe = self.find_recipe_by_name(recipe_id, {"original_id": 1})
+                if not recipe:
+                    return []
+                recipe_id = str(recipe["original_id"])
             original_id = int(recipe_id)  # Convert string input to integer
-            recipe = self.db.recipes.find_one({"original_id": original_id})
-            if not recipe:
+            ingredient_field, _ = self._list_fields()
+            recipe = self.db.recipes.find_one({"original_id": original_id}, {ingredient_field: 1})
+            if not recipe or ingredient_field not in recipe:
                 return []
 
-            return list(self.db.recipes.aggregate([
-                {
-                    "$match": {
-                        "original_id": {"$ne": original_id},
-                        "ingredients": {"$in": recipe["ingredients"]}
-                    }
-                },
+            match = [{
+                "$match": {
+                    "original_id": {"$ne": original_id},
+                    ingredient_field: {"$in": recipe[ingredient_field]}
+                }
+            }]
+            if self._fallback:
+                # Approximate: rank only the first candidates found instead of every recipe sharing an ingredient
+                match.append({"$limit": SIMILAR_FALLBACK_CANDIDATES})
+            return list(self.db.recipes.aggregate(match + [
                 {
                     "$addFields": {
                         "common_ingredients": {
                             "$size": {
-                                "$setIntersection": ["$ingredients", recipe["ingredients"]]
+                                "$setIntersection": [f"${ingredient_field}", recipe[ingredient_field]]
                             }
                         }
                     }
@@ -103,9 +378,20 @@ class RecipeApp:
         except ValueError:
             print("Error: Recipe ID must be a number")
             return []
-    def find_top_rated(self, limit: int = 5) -> List[Dict[str, Any]]:
-        return list(self.db.recipes.find(
-            {"review_count": {"$gte": 10}},  # Only include recipes with at least 10 reviews
+    @with_deadline()
+    def find_top_rated(self, limit: int = 5, tag: str = None) -> List[Dict[str, Any]]:
+        """Confidence-adjusted top recipes, globally or for one tag, from a precomputed leaderboard"""
+        # Out of time: at most what the board itself holds rather than a live ranking
+        entries = top_entries(self.db, tag, min(limit, LEADERBOARD_SIZE) if self._fallback else limit)
+        if entries is not None:
+            return entries
+
+        # No board for this tag (or none built yet): rank by raw rating on the fly
+        query = {"review_count": {"$gte": 10}}  # Only include recipes with at least 10 reviews
+        if tag:
+            query["tags"] = tag
+        return self._ranked(self.db.recipes.find(
+            query,
             {
                 "name": 1,
                 "ingredients": 1,
@@ -113,59 +399,90 @@ class RecipeApp:
                 "avg_rating": 1,
                 "review_count": 1
             }
-        ).sort([
+        ).limit(limit), [
             ("avg_rating", -1),
             ("review_count", -1)
-        ]).limit(limit))
+        ])
+
+    def _top_rated_fallback(self, limit: int) -> List[Dict[str, Any]]:
+        return list(self._ranked(self.db.recipes.find(
+            {"avg_rating": {"$exists": True, "$gte": 4.0}, "review_count": {"$gte": 10}},
+            {"name": 1, "ingredients": 1, "tags": 1, "avg_rating": 1}
+        ).limit(limit), [("avg_rating", -1)]))
 
+    @staticmethod
+    def _weighted_overlap(field: str, weighted: List[Any]) -> Dict[str, Any]:
+        """Sum of the weights of ``weighted`` (id, weight) items present in ``field``"""
+        items = [item for item, _ in weighted]
+        weights = [weight for _, weight in weighted]
+        return {"$sum": {"$map": {
+            "input": {"$setIntersection": [f"${field}", items]},
+            "as": "item",
+            "in": {"$arrayElemAt": [weights, {"$indexOfArray": [items, "$$item"]}]}
+        }}}
+
+    @with_deadline()
     def get_personalized_recommendations(self, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+        if self._fallback:
+            # Out of time: the precomputed global leaderboard is a single document read
+            entries = top_entries(self.db, None, limit)
+            return entries if entries is not None else self._top_rated_fallback(limit)
+
         # Convert user_id to integer if it's numeric
         try:
             # Convert user_id to integer
             numeric_user_id = int(user_id)
 
-            # First, efficiently get user's rated recipes with index
-            user_ratings = list(self.db.reviews.find(
-                {"user_id": numeric_user_id},
-                {"recipe_id": 1, "rating": 1, "_id": 0}
-            ).hint("user_id_1"))  # Use the existing index
-
-            if not user_ratings:
-                print(f"No rating history found for user {user_id}. Showing top-rated recipes instead.")
-                return list(self.db.recipes.find(
-                    {"avg_rating": {"$exists": True, "$gte": 4.0}, "review_count": {"$gte": 10}},
-                    {"name": 1, "ingredients": 1, "tags": 1, "avg_rating": 1}
-                ).sort("avg_rating", -1).limit(limit))
-
-            # Get highly rated recipes (4 or 5 stars)
-            liked_recipe_ids = [r["recipe_id"] for r in user_ratings if r["rating"] >= 4]
-
-            if not liked_recipe_ids:
-                print(f"No highly rated recipes found for user {user_id}. Showing top-rated recipes instead.")
-                return list(self.db.recipes.find(
-                    {"avg_rating": {"$exists": True, "$gte": 4.0}, "review_count": {"$gte": 10}},
-                    {"name": 1, "ingredients": 1, "tags": 1, "avg_rating": 1}
-                ).sort("avg_rating", -1).limit(limit))
-
-            # Get liked recipes' ingredients and tags efficiently
-            liked_recipes = list(self.db.recipes.find(
-                {"_id": {"$in": liked_recipe_ids}},
-                {"ingredients": 1, "tags": 1}
-            ))
-
-            # Extract unique ingredients and tags
-            liked_ingredients = set()
-            liked_tags = set()
-            for recipe in liked_recipes:
-                liked_ingredients.update(recipe.get("ingredients", []))
-                liked_tags.update(recipe.get("tags", []))
-
-            # Convert to lists for MongoDB query
-            ingredients_list = list(liked_ingredients)[:50]  # Limit to top 50 ingredients
-            tags_list = list(liked_tags)[:20]  # Limit to top 20 tags
-
-            # Get recipes the user hasn't rated
-            rated_recipe_ids = [r["recipe_id"] for r in user_ratings]
+            # A materialised profile answers in one read, already ranked by preference weight
+            profile = None
+            if self._get_dictionaries():
+                profile = self.db.taste_profiles.find_one({"_id": numeric_user_id})
+
+            if profile is not None:
+                ingredient_field, tag_field = "ingredient_ids", "tag_ids"
+                ingredient_weights = top_preferences(profile, "ingredients", TOP_INGREDIENTS)
+                tag_weights = top_preferences(profile, "tags", TOP_TAGS)
+                rated_recipe_ids = profile.get("rated", [])
+                if not ingredient_weights and not tag_weights:
+                    print(f"No highly rated recipes found for user {user_id}. Showing top-rated recipes instead.")
+                    return self._top_rated_fallback(limit)
+            else:
+                # No profile yet: derive preferences from the raw ratings
+                user_ratings = list(self.db.reviews.find(
+                    {"user_id": numeric_user_id},
+                    {"recipe_id": 1, "rating": 1, "_id": 0}
+                ).hint("user_id_1"))  # Use the existing index
+
+                if not user_ratings:
+                    print(f"No rating history found for user {user_id}. Showing top-rated recipes instead.")
+                    return self._top_rated_fallback(limit)
+
+                # Get highly rated recipes (4 or 5 stars)
+                liked_recipe_ids = [r["recipe_id"] for r in user_ratings if r["rating"] >= 4]
+
+                if not liked_recipe_ids:
+                    print(f"No highly rated recipes found for user {user_id}. Showing top-rated recipes instead.")
+                    return self._top_rated_fallback(limit)
+
+                # Get liked recipes' ingredients and tags efficiently
+                ingredient_field, tag_field = self._list_fields()
+                liked_recipes = list(self.db.recipes.find(
+                    {"_id": {"$in": liked_recipe_ids}},
+                    {ingredient_field: 1, tag_field: 1}
+                ))
+
+                # Count how many liked recipes use each ingredient and tag
+                liked_ingredients = Counter()
+                liked_tags = Counter()
+                for recipe in liked_recipes:
+                    liked_ingredients.update(recipe.get(ingredient_field, []))
+                    liked_tags.update(recipe.get(tag_field, []))
+
+                ingredient_weights = [(i, 1.0) for i, _ in liked_ingredients.most_common(TOP_INGREDIENTS)]
+                tag_weights = [(t, 1.0) for t, _ in liked_tags.most_common(TOP_TAGS)]
+
+                # Get recipes the user hasn't rated
+                rated_recipe_ids = [r["recipe_id"] for r in user_ratings]
 
             # Simplified and optimized aggregation pipeline
             pipeline = [
@@ -173,24 +490,16 @@ class RecipeApp:
                     "$match": {
                         "_id": {"$nin": rated_recipe_ids},
                         "$or": [
-                            {"ingredients": {"$in": ingredients_list}},
-                            {"tags": {"$in": tags_list}}
+                            {ingredient_field: {"$in": [i for i, _ in ingredient_weights]}},
+                            {tag_field: {"$in": [t for t, _ in tag_weights]}}
                         ],
                         "avg_rating": {"$gte": 3.5}  # Only consider well-rated recipes
                     }
                 },
                 {
                     "$addFields": {
-                        "ingredient_match": {
-                            "$size": {
-                                "$setIntersection": ["$ingredients", ingredients_list]
-                            }
-                        },
-                        "tag_match": {
-                            "$size": {
-                                "$setIntersection": ["$tags", tags_list]
-                            }
-                        }
+                        "ingredient_match": self._weighted_overlap(ingredient_field, ingredient_weights),
+                        "tag_match": self._weighted_overlap(tag_field, tag_weights)
                     }
                 },
                 {
@@ -212,41 +521,133 @@ class RecipeApp:
                         "ingredients": 1,
                         "tags": 1,
                         "avg_rating": 1,
-                        "match_score": 1
+                        "match_score": {"$round": ["$match_score", 2]}
                     }
                 }
             ]
 
-            # Execute aggregation with timeout
-            recommendations = list(self.db.recipes.aggregate(
-                pipeline,
-                maxTimeMS=5000  # 5-second timeout
-            ))
-
-            return recommendations
+            # Bounded by the call's deadline like every other operation here
+            return list(self.db.recipes.aggregate(pipeline))
 
         except Exception as e:
+            if is_timeout(e):
+                raise
             print(f"Error generating recommendations: {str(e)}")
             # Fallback to top-rated recipes
-            return list(self.db.recipes.find(
-                {"avg_rating": {"$exists": True, "$gte": 4.0}, "review_count": {"$gte": 10}},
-                {"name": 1, "ingredients": 1, "tags": 1, "avg_rating": 1}
-            ).sort("avg_rating", -1).limit(limit))
+            return self._top_rated_fallback(limit)
+
+    @with_deadline(empty=None, fallback=False, write=True)
+    def rate_recipe(self, user_id: str, recipe_id: str, rating: int, review: str = None) -> Dict[str, Any]:
+        """Record a rating and update everything derived from it incrementally.
+
+        A user has one rating per recipe: rating it again revises the earlier
+        review (and the recipe's stats by the difference) instead of adding one.
+        """
+        numeric_user_id = int(user_id)
+        recipe = self.db.recipes.find_one({"original_id": int(recipe_id)},
+                                          {"name": 1, "ingredient_ids": 1, "tag_ids": 1})
+        if not recipe:
+            return None
+
+        previous = self.db.reviews.find_one({"user_id": numeric_user_id, "recipe_id": recipe["_id"]},
+                                            {"recipe_id": 1, "rating": 1, "date": 1, "review": 1},
+                                            sort=[("date", -1)])
+        review_doc = {
+            "recipe_id": recipe["_id"],
+            "user_id": numeric_user_id,
+            "date": datetime.now(),
+            "rating": rating,
+            "review": review,
+            "source_dataset": "recipehub",
+            # Picked up (and cleared) by the next review index refresh
+            "index_pending": True
+        }
+        if previous:
+            # Revision: the stored review takes the new rating and date (and text, if any)
+            if review is None:
+                review_doc["review"] = previous.get("review")
+            review_doc["_id"] = previous["_id"]
+            self.db.reviews.replace_one({"_id": previous["_id"]}, review_doc)
+            remove_review(self.db, previous)
+            # Same count; shift the average and distribution by the difference
+            self.db.recipes.update_one({"_id": recipe["_id"]}, [
+                {"$set": {
+                    "avg_rating": {"$add": [{"$ifNull": ["$avg_rating", 0]}, {"$divide": [
+                        rating - previous["rating"], {"$max": [{"$ifNull": ["$review_count", 1]}, 1]}
+                    ]}]},
+                    f"ratings_distribution.{previous['rating']}": {
+                        "$add": [{"$ifNull": [f"$ratings_distribution.{previous['rating']}", 0]}, -1]
+                    }
+                }},
+                {"$set": {
+                    f"ratings_distribution.{rating}": {
+                        "$add": [{"$ifNull": [f"$ratings_distribution.{rating}", 0]}, 1]
+                    }
+                }}
+            ])
+        else:
+            review_doc["_id"] = self.db.reviews.insert_one(review_doc).inserted_id
+            # Running average update, same fields calculate_recipe_stats produces
+            self.db.recipes.update_one({"_id": recipe["_id"]}, [
+                {"$set": {
+                    "avg_rating": {"$divide": [
+                        {"$add": [{"$multiply": [{"$ifNull": ["$avg_rating", 0]},
+                                                 {"$ifNull": ["$review_count", 0]}]}, rating]},
+                        {"$add": [{"$ifNull": ["$review_count", 0]}, 1]}
+                    ]},
+                    "review_count": {"$add": [{"$ifNull": ["$review_count", 0]}, 1]},
+                    f"ratings_distribution.{rating}": {
+                        "$add": [{"$ifNull": [f"$ratings_distribution.{rating}", 0]}, 1]
+                    }
+                }}
+            ])
+        add_review(self.db, review_doc)
+        self._facet_cache.clear()
+        record_reviews(self.db, [review_doc])
+        apply_rating(self.db, numeric_user_id, recipe, rating,
+                     previous["rating"] if previous else None)
+        refresh_recipes(self.db, [recipe["_id"]])
+        return {"recipe_name": recipe["name"], "rating": rating}
 
+    @with_deadline(empty=lambda: {"trending_recipes": [], "seasonal_patterns": {}})
     def analyze_trends(self, days: int = 30) -> Dict[str, Any]:
         """Analyze recipe trends and seasonal patterns with improved formatting"""
         cutoff_date = datetime.now() - timedelta(days=days)
 
-        # Analyze trending recipes
-        trending = list(self.db.reviews.aggregate([
-            {"$match": {"date": {"$gte": cutoff_date}}},
-            {
-                "$group": {
-                    "_id": "$recipe_id",
-                    "recent_ratings": {"$avg": "$rating"},
-                    "review_count": {"$sum": 1}
+        if self._has_review_buckets():
+            # Monthly buckets: seasonal stats come straight from bucket counters
+            source = self.db.review_buckets
+            # Out of time: whole-month counters instead of unwinding individual reviews
+            trending_stages = (trending_counters_pipeline(cutoff_date) if self._fallback
+                               else trending_pipeline(cutoff_date))
+            seasonal_stages = seasonal_pipeline()
+        else:
+            source = self.db.reviews
+            trending_stages = [
+                {"$match": {"date": {"$gte": cutoff_date}}},
+                {
+                    "$group": {
+                        "_id": "$recipe_id",
+                        "recent_ratings": {"$avg": "$rating"},
+                        "review_count": {"$sum": 1}
+                    }
                 }
-            },
+            ]
+            seasonal_stages = [
+                {
+                    "$group": {
+                        "_id": {
+                            "recipe": "$recipe_id",
+                            "month": {"$month": "$date"}
+                        },
+                        "avg_rating": {"$avg": "$rating"},
+                        "count": {"$sum": 1}
+                    }
+                }
+            ]
+
+        # Analyze trending recipes
+        trending = list(source.aggregate(trending_stages + [
             {"$match": {"review_count": {"$gte": 5}}},
             {"$sort": {"recent_ratings": -1, "review_count": -1}},
             {"$limit": 10},
@@ -269,18 +670,8 @@ class RecipeApp:
             }
         ]))
 
-        # Analyze seasonal patterns
-        seasonal = list(self.db.reviews.aggregate([
-            {
-                "$group": {
-                    "_id": {
-                        "recipe": "$recipe_id",
-                        "month": {"$month": "$date"}
-                    },
-                    "avg_rating": {"$avg": "$rating"},
-                    "count": {"$sum": 1}
-                }
-            },
+        # Analyze seasonal patterns (skipped on the fallback path)
+        seasonal = [] if self._fallback else list(source.aggregate(seasonal_stages + [
             {"$match": {"count": {"$gte": 5}}},
             {"$sort": {"avg_rating": -1}},
             {
@@ -342,12 +733,22 @@ class RecipeApp:
             }
         }
 
+    @with_deadline(empty=None)
     def analyze_sentiment_detailed(self, recipe_name: str) -> Dict[str, Any]:
-        recipe = self.db.recipes.find_one({"name": {"$regex": recipe_name, "$options": "i"}})
+        projection = {"name": 1, "avg_rating": 1}
+        if self._fallback:
+            projection["reviews"] = 1
+        recipe = self.find_recipe_by_name(recipe_name, projection)
         if not recipe:
             return None
 
-        reviews = list(self.db.reviews.find({"recipe_id": recipe["_id"]}))
+        if self._fallback:
+            # Out of time: only the recent reviews embedded on the recipe, truncated to summaries
+            reviews = [{"rating": r["rating"], "review": r.get("summary")} for r in recipe.get("reviews", [])]
+        elif self._has_review_buckets():
+            reviews = bucketed_reviews(self.db, recipe["_id"])
+        else:
+            reviews = list(self.db.reviews.find({"recipe_id": recipe["_id"]}))
         sentiment_scores = []
 
         for review in reviews:
@@ -379,45 +780,142 @@ class RecipeApp:
             },
             "sample_reviews": sorted(sentiment_scores, key=lambda x: abs(x["polarity"]), reverse=True)[:5]
         }
-    def find_by_diet(self, restriction: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """Find recipes that match dietary restrictions"""
-        restriction = restriction.lower()
-        diet_keywords = {
-            'vegetarian': ['vegetarian', '-chicken', '-beef', '-pork', '-fish'],
-            'vegan': ['vegan', '-meat', '-egg', '-dairy', '-cheese'],
-            'gluten-free': ['gluten-free', '-wheat', '-flour'],
-            'keto': ['keto', 'low-carb'],
-            'paleo': ['paleo', '-grain', '-dairy'],
-            'dairy-free': ['dairy-free', '-milk', '-cheese', '-cream']
-        }
 
-        if restriction not in diet_keywords:
+    @with_deadline()
+    def search_reviews(self, query: ReviewQuery, limit: int = 5) -> List[Review]:
+        """Reviews containing every query word, best BM25 match first, with a snippet and the recipe name.
+
+        Recipe names come from the index. The stored review (text, rating,
+        date) is fetched for all hits in one query and checked against the
+        whole query again, since ``rate_recipe`` may have revised it after it
+        was indexed; ratings not yet indexed are picked up by the next refresh.
+        """
+        if self._review_index is None:
+            self._review_index = ReviewIndex.load() or False
+        if not self._review_index:
+            print("Review index has not been built yet. Run data-creation.py first.")
             return []
 
-        query = {"$and": []}
-
-        # Add positive keywords
-        positive_terms = [kw for kw in diet_keywords[restriction] if not kw.startswith('-')]
-        if positive_terms:
-            query["$and"].append({"tags": {"$in": positive_terms}})
-
-        # Add negative keywords
-        negative_terms = [kw[1:] for kw in diet_keywords[restriction] if kw.startswith('-')]
-        if negative_terms:
-            for term in negative_terms:
-                query["$and"].append({
-                    "$and": [
-                        {"ingredients": {"$not": {"$regex": term, "$options": "i"}}},
-                        {"tags": {"$not": {"$regex": term, "$options": "i"}}}
-                    ]
-                })
+        hits = self._review_index.search(query, limit * PHRASE_CANDIDATES if query.phrases else limit)
+        if self._fallback:
+            # Out of time: what the index alone knows (recipe, date, rating), phrases unchecked
+            return [Review.from_document(hit) for hit in hits[:limit]]
+        docs = {doc["_id"]: doc for doc in self.db.reviews.find(
+            {"_id": {"$in": [hit["_id"] for hit in hits]}},
+            {"review": 1, "user_id": 1, "rating": 1, "date": 1}
+        )}
+        results = []
+        for hit in hits:
+            doc = docs.get(hit["_id"])
+            if not doc or not query.matches(doc):
+                continue
+            review = Review.from_document(hit)
+            review.user_id = doc.get("user_id")
+            review.rating = doc.get("rating")
+            review.date = doc.get("date")
+            review.snippet = snippet(doc.get("review") or "", query.text)
+            results.append(review)
+            if len(results) == limit:
+                break
+        return results
 
-        return list(self.db.recipes.find(
+    @with_deadline(empty=lambda: {"hits": [], "facets": {}, "total": 0})
+    def faceted_search(self, kind: str, term: str, limit: int = 5) -> Dict[str, Any]:
+        """Top hits of a search/cuisine/diet query plus cooking-time, calorie, rating and tag counts.
+
+        Hits and every facet come from a single ``$facet`` aggregation, and the
+        response is cached on the normalised query.
+        """
+        finders = {"search": self.search_recipes, "cuisine": self.find_by_cuisine, "diet": self.find_by_diet}
+        if kind not in finders:
+            raise ValueError(f"Facets are available for {', '.join(finders)}")
+        if self._fallback:
+            # Out of time: the plain (itself degraded) hits, without counts
+            return {"hits": list(finders[kind](term, limit)), "facets": {}, "total": None}
+
+        key = FacetCache.key(kind, term, limit)
+        cached = self._facet_cache.get(key)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+        projection = {"$project": {"name": 1, "ingredients": 1, "avg_rating": 1, "original_id": 1, "minutes": 1}}
+        if kind == "search":
+            index = self._get_search_index()
+            if index is not None:
+                # Facets count every index match; hits keep the BM25 + rating order of the best ones
+                ids = [original_id for original_id, _ in index.search(term, index.doc_count)]
+                top = ids[:max(limit, TEXT_CANDIDATES)]
+                match = {"original_id": {"$in": ids}}
+                hits = [{"$match": {"original_id": {"$in": top}}},
+                        {"$addFields": {"rank": {"$indexOfArray": [top, "$original_id"]}}},
+                        {"$sort": {"rank": 1}}, {"$limit": limit}, projection]
+            else:
+                match = {"$text": {"$search": term}}
+                hits = [{"$sort": {"score": {"$meta": "textScore"}}}, {"$limit": limit}, projection]
+        else:
+            match = self._cuisine_filter(term) if kind == "cuisine" else diet_filter(term)
+            if match is None:
+                return {"hits": [], "facets": {}, "total": 0}
+            hits = [{"$sort": {"avg_rating": -1}}, {"$limit": limit}, projection]
+
+        _, tag_field = self._list_fields()
+        result = next(self.db.recipes.aggregate(facet_pipeline(match, hits, tag_field), allowDiskUse=True))
+        tag_names = self._get_dictionaries()["tags"].names if tag_field == "tag_ids" else None
+        response = {
+            "hits": result["hits"],
+            "facets": format_facets(result, tag_names),
+            "total": result["total"][0]["count"] if result["total"] else 0
+        }
+        self._facet_cache.put(key, response)
+        return response
+
+    @with_deadline()
+    def find_by_diet(self, restriction: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Find recipes that match dietary restrictions"""
+        query = diet_filter(restriction)
+        if query is None:
+            return []
+
+        return self._ranked(self.db.recipes.find(
             query,
             {"name": 1, "ingredients": 1, "tags": 1, "avg_rating": 1, "nutrition": 1}
-        ).sort("avg_rating", -1).limit(limit))
+        ).limit(limit), [("avg_rating", -1)])
+
+    def _nutrition_from_sketches(self) -> Dict[str, Any]:
+        """Approximate global nutrition summary from the precomputed KLL sketches"""
+        sketches = {}
+        for nutrient in NUTRIENTS:
+            doc = self.db.sketches.find_one({"_id": nutrition_key(nutrient, 0.0)})
+            if doc:
+                sketches[nutrient] = KLLSketch.from_doc(doc)
+        if "calories" not in sketches:
+            return {"overall_stats": None, "calorie_distribution": {},
+                    "sample_recipes": {"low_calorie": [], "high_protein": []}}
+
+        def mean(nutrient):
+            return sketches[nutrient].mean() if nutrient in sketches else 0.0
+
+        calories = sketches["calories"]
+        distribution = {}
+        previous = 0.0
+        for label, bound in (("Low Calorie", 300), ("Medium Calorie", 600), ("High Calorie", 1000),
+                             ("Very High Calorie", 2000), ("Extremely High Calorie", float("inf"))):
+            rank = calories.rank(bound) if bound != float("inf") else 1.0
+            distribution[label] = {"count": round((rank - previous) * calories.n), "avg_rating": None}
+            previous = rank
+        return {
+            "overall_stats": {"avg_calories": mean("calories"), "avg_protein": mean("protein"),
+                              "avg_fat": mean("total_fat"), "avg_carbs": mean("carbohydrates"),
+                              "recipe_count": calories.n},
+            "calorie_distribution": distribution,
+            "sample_recipes": {"low_calorie": [], "high_protein": []}
+        }
 
+    @with_deadline(empty=lambda: {"overall_stats": None, "calorie_distribution": {},
+                                  "sample_recipes": {"low_calorie": [], "high_protein": []}})
     def analyze_nutritional_patterns(self, user_id: str = None) -> Dict[str, Any]:
+        if self._fallback and not user_id:
+            return self._nutrition_from_sketches()
         match_stage = {}
         if user_id:
             try:
@@ -0,0 +1,503 @@
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import MongoClient
+
+from search_index import DEFAULT_INDEX_DIR, STOPWORDS, TOKENIZER_VERSION, build_postings, tokenize
+
+REVIEW_INDEX_PATH = os.path.join(DEFAULT_INDEX_DIR, "reviews")
+
+# Reviews per build chunk; each chunk is read and indexed by its own worker process
+CHUNK_REVIEWS = 100_000
+
+REVIEW_PROJECTION = {"review": 1, "recipe_id": 1, "date": 1, "rating": 1}
+
+# A quoted phrase is checked against the review text after the index lookup, so
+# this many times the limit is fetched to leave room for candidates that fail it
+PHRASE_CANDIDATES = 10
+
+SNIPPET_CHARS = 160
+
+# Sentinels for reviews without a date or rating; they never pass a filter on that field
+NO_DATE = np.iinfo(np.int32).min
+NO_RATING = -1
+
+EPOCH = datetime(1970, 1, 1)
+
+_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m", "%Y")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _parse_date(value: str, end: bool = False) -> datetime:
+    """``YYYY``, ``YYYY-MM`` or ``YYYY-MM-DD``; with ``end`` the last day of that period"""
+    for fmt in _DATE_FORMATS:
+        try:
+            start = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if not end or fmt == "%Y-%m-%d":
+            return start
+        if fmt == "%Y":
+            return start.replace(month=12, day=31)
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    raise ValueError(f"Invalid date '{value}', expected YYYY, YYYY-MM or YYYY-MM-DD")
+
+
+def _day(date: Any) -> int:
+    return (date - EPOCH).days if isinstance(date, datetime) else NO_DATE
+
+
+@dataclass
+class ReviewQuery:
+    """Words every review must contain, optional quoted phrases, and rating/date ranges"""
+    text: str = ""
+    phrases: List[str] = field(default_factory=list)
+    min_rating: Optional[int] = None
+    max_rating: Optional[int] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    _CONDITION_RE = re.compile(r"^(rating|date)(<=|>=|=)(.+)$")
+
+    @classmethod
+    def parse(cls, args: List[str]) -> "ReviewQuery":
+        """Parse CLI arguments such as ``"too salty" rating<=2 date>=2015 date<=2016-06``.
+
+        Bare words are required words; double quotes additionally require them
+        in that order. Dates take ``YYYY``, ``YYYY-MM`` or ``YYYY-MM-DD`` and
+        both bounds are inclusive. Raises ValueError on malformed conditions.
+        """
+        query = cls()
+        words = []
+        for arg in args:
+            match = cls._CONDITION_RE.match(arg.lower())
+            if not match:
+                words.append(arg)
+                continue
+            key, op, value = match.groups()
+            if key == "rating":
+                if not value.isdigit():
+                    raise ValueError(f"Rating must be a whole number, got '{value}'")
+                if op in (">=", "="):
+                    query.min_rating = int(value)
+                if op in ("<=", "="):
+                    query.max_rating = int(value)
+            else:
+                if op in (">=", "="):
+                    query.since = _parse_date(value)
+                if op in ("<=", "="):
+                    query.until = _parse_date(value, end=True)
+        query.text = " ".join(words)
+        query.phrases = [p for p in re.findall(r'"([^"]+)"', query.text) if len(tokenize(p)) > 1]
+        if not query.terms:
+            raise ValueError("Give at least one word to search for, e.g. reviews too salty")
+        return query
+
+    @property
+    def terms(self) -> List[str]:
+        return list(dict.fromkeys(tokenize(self.text)))
+
+    def matches(self, review: Dict[str, Any]) -> bool:
+        """Whether a stored review satisfies the whole query; its indexed copy may predate a revision"""
+        rating, day = review.get("rating"), _day(review.get("date"))
+        if self.min_rating is not None and (rating is None or rating < self.min_rating):
+            return False
+        if self.max_rating is not None and (rating is None or rating > self.max_rating):
+            return False
+        if self.since is not None and (day == NO_DATE or day < _day(self.since)):
+            return False
+        if self.until is not None and (day == NO_DATE or day > _day(self.until)):
+            return False
+        text = review.get("review")
+        return (set(self.terms) <= set(tokenize(text))
+                and all(contains_phrase(text, phrase) for phrase in self.phrases))
+
+
+def contains_phrase(text: Optional[str], phrase: str) -> bool:
+    """Whether the phrase's words appear consecutively in ``text`` (stopwords ignored, as in the index)"""
+    needle, haystack = tokenize(phrase), tokenize(text)
+    return any(haystack[i:i + len(needle)] == needle for i in range(len(haystack) - len(needle) + 1))
+
+
+def snippet(text: str, query: str, width: int = SNIPPET_CHARS) -> str:
+    """About ``width`` characters of ``text`` around the first query word"""
+    text = " ".join(text.split())
+    words = {w for w in _WORD_RE.findall(query.lower()) if w not in STOPWORDS} | set(tokenize(query))
+    match = re.search(r"\b(" + "|".join(map(re.escape, sorted(words, key=len, reverse=True))) + ")",
+                      text, re.IGNORECASE) if words else None
+    position = match.start() if match else 0
+    start = max(0, position - width // 4)
+    if start:
+        # Start on a word boundary rather than mid-word
+        space = text.find(" ", start, position)
+        start = space + 1 if space != -1 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > start else end
+    return ("..." if start else "") + text[start:end] + ("..." if end < len(text) else "")
+
+
+def _object_ids(ids: Iterable[ObjectId]) -> np.ndarray:
+    """ObjectIds as an ``(n, 12)`` uint8 matrix (fixed-width bytes dtypes would drop trailing zeros)"""
+    raw = b"".join(i.binary for i in ids)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, 12).copy()
+
+
+class _ReviewSegment:
+    """Postings for one chunk of reviews plus their per-review arrays.
+
+    Postings use the same CSR layout as the recipe index. Each review keeps
+    its date, rating and an index into the segment's own recipe table, which
+    holds the recipe IDs and names so results need no join.
+    """
+
+    ARRAYS = ("offsets", "docs", "tfs", "doc_len", "review_ids", "recipe_idx", "dates", "ratings", "recipe_ids")
+
+    def __init__(self, terms: List[str], offsets, docs, tfs, doc_len, review_ids, recipe_idx, dates, ratings,
+                 recipe_ids, recipe_names: Optional[List[str]] = None, path: Optional[str] = None):
+        self.terms = terms
+        self.term_ids = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.review_ids = review_ids
+        self.recipe_idx = recipe_idx
+        self.dates = dates
+        self.ratings = ratings
+        self.recipe_ids = recipe_ids
+        self._recipe_names = recipe_names
+        self.path = path
+
+    @property
+    def size(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def recipe_names(self) -> List[str]:
+        # Only read once a query actually returns a review from this segment
+        if self._recipe_names is None:
+            with open(os.path.join(self.path, "recipe_names.json")) as f:
+                self._recipe_names = json.load(f)
+        return self._recipe_names
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        idx = self.term_ids.get(term)
+        if idx is None:
+            return None, None
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def df(self, term: str) -> int:
+        idx = self.term_ids.get(term)
+        if idx is None:
+            return 0
+        return int(self.offsets[idx + 1] - self.offsets[idx])
+
+    def passes(self, docs: np.ndarray, query: ReviewQuery) -> np.ndarray:
+        """Mask of ``docs`` inside the query's rating and date ranges"""
+        mask = np.ones(len(docs), dtype=bool)
+        if query.min_rating is not None or query.max_rating is not None:
+            ratings = self.ratings[docs]
+            mask &= ratings != NO_RATING
+            if query.min_rating is not None:
+                mask &= ratings >= query.min_rating
+            if query.max_rating is not None:
+                mask &= ratings <= query.max_rating
+        if query.since is not None or query.until is not None:
+            dates = self.dates[docs]
+            mask &= dates != NO_DATE
+            if query.since is not None:
+                mask &= dates >= _day(query.since)
+            if query.until is not None:
+                mask &= dates <= _day(query.until)
+        return mask
+
+    @classmethod
+    def from_reviews(cls, reviews: Iterable[Dict[str, Any]], db) -> "_ReviewSegment":
+        """Index reviews that have text, then look up the names of their recipes in one query"""
+        vocab: Dict[str, int] = {}
+        recipe_lookup: Dict[ObjectId, int] = {}
+        term_chunks, tf_chunks, doc_chunks = [], [], []
+        doc_len, review_ids, recipe_idx, dates, ratings = [], [], [], [], []
+
+        for review in reviews:
+            tokens = tokenize(review.get("review"))
+            if not tokens:
+                continue
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term_id = vocab.setdefault(token, len(vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            doc_idx = len(doc_len)
+            term_chunks.append(np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)))
+            tf_chunks.append(np.fromiter(counts.values(), dtype=np.int32, count=len(counts)))
+            doc_chunks.append(np.full(len(counts), doc_idx, dtype=np.int32))
+            doc_len.append(len(tokens))
+            review_ids.append(review["_id"])
+            recipe_idx.append(recipe_lookup.setdefault(review["recipe_id"], len(recipe_lookup)))
+            dates.append(_day(review.get("date")))
+            rating = review.get("rating")
+            ratings.append(int(rating) if rating is not None else NO_RATING)
+
+        terms = sorted(vocab)
+        remap = np.empty(len(vocab), dtype=np.int32)
+        for new_id, term in enumerate(terms):
+            remap[vocab[term]] = new_id
+        empty = np.empty(0, dtype=np.int32)
+        offsets, docs, tfs = build_postings(
+            len(terms),
+            remap[np.concatenate(term_chunks)] if term_chunks else empty,
+            np.concatenate(doc_chunks) if doc_chunks else empty,
+            np.concatenate(tf_chunks) if tf_chunks else empty
+        )
+
+        recipe_ids = list(recipe_lookup)
+        names = {r["_id"]: r.get("name", "") for r in db.recipes.find({"_id": {"$in": recipe_ids}}, {"name": 1})}
+        return cls(terms, offsets, docs, tfs, np.asarray(doc_len, dtype=np.int32), _object_ids(review_ids),
+                   np.asarray(recipe_idx, dtype=np.int32), np.asarray(dates, dtype=np.int32),
+                   np.asarray(ratings, dtype=np.int8), _object_ids(recipe_ids),
+                   [names.get(i, "") for i in recipe_ids])
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "terms.json"), "w") as f:
+            json.dump(self.terms, f)
+        with open(os.path.join(path, "recipe_names.json"), "w") as f:
+            json.dump(self.recipe_names, f)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(getattr(self, name)))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "_ReviewSegment":
+        mode = "r" if mmap else None
+        with open(os.path.join(path, "terms.json")) as f:
+            terms = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in cls.ARRAYS}
+        return cls(terms, path=path, **arrays)
+
+
+def _read_meta(path: str) -> Optional[Dict[str, Any]]:
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    # An index tokenised differently reads as missing, so it gets rebuilt
+    return meta if meta.get("tokenizer") == TOKENIZER_VERSION else None
+
+
+def _write_meta(path: str, meta: Dict[str, Any]) -> None:
+    # Written aside and renamed so readers see either the old or the new segment list
+    tmp = os.path.join(path, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, "meta.json"))
+
+
+class ReviewIndex:
+    """BM25 index over review text, split into independently built segments.
+
+    A query requires every word: candidates come from the rarest word's
+    postings, are narrowed by the rating/date filters, and are then
+    intersected with the other words' postings by binary search, so the work
+    is bounded by the rarest word rather than the number of reviews.
+    """
+
+    def __init__(self, segments: List[_ReviewSegment], k1: float = 1.2, b: float = 0.75):
+        self.segments = segments
+        self.k1 = k1
+        self.b = b
+        self.doc_count = sum(seg.size for seg in segments)
+        total = sum(float(seg.doc_len.sum()) for seg in segments)
+        self.avg_doc_len = total / self.doc_count if self.doc_count else 1.0
+
+    @classmethod
+    def load(cls, path: str = REVIEW_INDEX_PATH, mmap: bool = True) -> Optional["ReviewIndex"]:
+        meta = _read_meta(path)
+        if meta is None:
+            return None
+        segments = [_ReviewSegment.load(os.path.join(path, name), mmap=mmap) for name in meta["segments"]]
+        return cls(segments, k1=meta.get("k1", 1.2), b=meta.get("b", 0.75))
+
+    def search(self, query: ReviewQuery, limit: int = 5) -> List[Dict[str, Any]]:
+        """The ``limit`` best-matching reviews as ``_id``/``recipe_id``/``recipe_name``/``date``/``rating``/``score``"""
+        dfs = {term: sum(seg.df(term) for seg in self.segments) for term in query.terms}
+        if not dfs or not all(dfs.values()):
+            return []
+        terms = sorted(dfs, key=dfs.get)
+        idf = {t: np.float32(np.log1p((self.doc_count - df + 0.5) / (df + 0.5))) for t, df in dfs.items()}
+
+        results = []
+        for seg in self.segments:
+            docs, _ = seg.postings(terms[0])
+            if docs is None:
+                continue
+            docs = docs[seg.passes(docs, query)]
+            scores = np.zeros(len(docs), dtype=np.float32)
+            for term in terms:
+                term_docs, tfs = seg.postings(term)
+                if term_docs is None or not len(docs):
+                    docs = docs[:0]
+                    break
+                pos = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+                found = term_docs[pos] == docs
+                docs, scores, pos = docs[found], scores[found], pos[found]
+                tf = tfs[pos].astype(np.float32)
+                norm = self.k1 * (1.0 - self.b + self.b * seg.doc_len[docs] / self.avg_doc_len)
+                scores += idf[term] * tf * (self.k1 + 1.0) / (tf + norm)
+            if len(docs):
+                results.append((seg, docs, scores))
+
+        if not results:
+            return []
+        owners = np.concatenate([np.full(len(d), i, dtype=np.int32) for i, (_, d, _) in enumerate(results)])
+        docs = np.concatenate([d for _, d, _ in results])
+        scores = np.concatenate([s for _, _, s in results])
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        hits, seen = [], set()
+        for i in top:
+            seg, doc = results[owners[i]][0], int(docs[i])
+            review_id = ObjectId(seg.review_ids[doc].tobytes())
+            if review_id in seen:
+                continue  # a revised review is indexed again in a later segment
+            seen.add(review_id)
+            recipe = int(seg.recipe_idx[doc])
+            day, rating = int(seg.dates[doc]), int(seg.ratings[doc])
+            hits.append({
+                "_id": review_id,
+                "recipe_id": ObjectId(seg.recipe_ids[recipe].tobytes()),
+                "recipe_name": seg.recipe_names[recipe],
+                "date": EPOCH + timedelta(days=day) if day != NO_DATE else None,
+                "rating": rating if rating != NO_RATING else None,
+                "score": round(float(scores[i]), 3)
+            })
+        return hits
+
+
+def _chunk_filters(db, chunks: int) -> List[Dict[str, Any]]:
+    """Split the reviews into about ``chunks`` contiguous, similar-sized ``_id`` ranges"""
+    if chunks <= 1:
+        return [{}]
+    buckets = db.reviews.aggregate([
+        {"$project": {"_id": 1}},
+        {"$bucketAuto": {"groupBy": "$_id", "buckets": chunks}}
+    ], allowDiskUse=True)
+    starts = [b["_id"]["min"] for b in buckets]
+    filters = []
+    for i, start in enumerate(starts):
+        id_range = {"$gte": start}
+        if i + 1 < len(starts):
+            id_range["$lt"] = starts[i + 1]
+        filters.append({"_id": id_range})
+    return filters or [{}]
+
+
+def _build_chunk(task: Tuple[Tuple[str, int], str, Dict[str, Any], str]) -> int:
+    """Worker: index one ``_id`` range and write its segment; returns the number of reviews indexed"""
+    address, db_name, chunk_filter, path = task
+    client = MongoClient(*address)
+    try:
+        db = client[db_name]
+        segment = _ReviewSegment.from_reviews(
+            db.reviews.find(chunk_filter, REVIEW_PROJECTION, batch_size=5000), db)
+        if segment.size:
+            segment.save(path)
+        return segment.size
+    finally:
+        client.close()
+
+
+def build_review_index(db, path: str = REVIEW_INDEX_PATH, workers: Optional[int] = None) -> ReviewIndex:
+    """Index every review's text in parallel ``_id`` chunks and persist the segments"""
+    print("Building review text index...")
+    # Ratings stamped before this point are covered by the build
+    pending = [r["_id"] for r in db.reviews.find({"index_pending": True}, {"_id": 1})]
+    total = db.reviews.estimated_document_count()
+    chunks = max(1, -(-total // CHUNK_REVIEWS))
+    workers = max(1, min(workers or os.cpu_count() or 1, chunks))
+
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    # Workers open their own connection; MongoClient must not be shared across processes
+    tasks = [(db.client.address, db.name, chunk_filter, os.path.join(tmp_path, f"seg_{i:03d}"))
+             for i, chunk_filter in enumerate(_chunk_filters(db, chunks))]
+    if workers > 1:
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            sizes = pool.map(_build_chunk, tasks)
+    else:
+        sizes = list(map(_build_chunk, tasks))
+
+    segments = [os.path.basename(task[-1]) for task, size in zip(tasks, sizes) if size]
+    _write_meta(tmp_path, {"segments": segments, "k1": 1.2, "b": 0.75, "doc_count": sum(sizes), "runs": [],
+                           "tokenizer": TOKENIZER_VERSION})
+    # Swap directories so readers never see a half-written index
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    if pending:
+        db.reviews.update_many({"_id": {"$in": pending}}, {"$unset": {"index_pending": ""}})
+    print(f"Indexed {sum(sizes)} reviews in {len(tasks)} chunks ({workers} workers) into {path}")
+    return ReviewIndex.load(path)
+
+
+def _append_segment(db, meta: Dict[str, Any], path: str, prefix: str, reviews_filter: Dict[str, Any]) -> int:
+    """Index the matching reviews as one more segment; returns how many were indexed"""
+    segment = _ReviewSegment.from_reviews(db.reviews.find(reviews_filter, REVIEW_PROJECTION), db)
+    if segment.size:
+        name = f"{prefix}_{len(meta['segments']):03d}"
+        segment.save(os.path.join(path, name))
+        meta["segments"].append(name)
+        meta["doc_count"] = meta.get("doc_count", 0) + segment.size
+    return segment.size
+
+
+def refresh_review_index(db, run: datetime, path: str = REVIEW_INDEX_PATH) -> Optional[ReviewIndex]:
+    """Append the reviews of one incremental import run, and any ratings made since, as new segments.
+
+    Existing segments are never rewritten. An import run is recorded in the
+    index metadata, so a resumed import doesn't index it twice. ``rate_recipe``
+    stamps the reviews it inserts or revises with ``index_pending``; they are
+    indexed again here and the stamp is cleared once the segment is saved.
+    A revised review's older copy stays in its segment: searches keep one hit
+    per review and check hits against the stored review before returning them.
+    """
+    meta = _read_meta(path)
+    if meta is None:
+        return build_review_index(db, path)
+    run_key = run.isoformat(timespec="milliseconds")  # MongoDB stores the run at millisecond precision
+    if run_key not in meta.get("runs", []):
+        indexed = _append_segment(db, meta, path, "run", {"import_run": run})
+        meta.setdefault("runs", []).append(run_key)
+        _write_meta(path, meta)
+        print(f"Indexed {indexed} new reviews into {path}")
+
+    pending = [r["_id"] for r in db.reviews.find({"index_pending": True}, {"_id": 1})]
+    if pending:
+        indexed = _append_segment(db, meta, path, "rated", {"_id": {"$in": pending}})
+        _write_meta(path, meta)
+        db.reviews.update_many({"_id": {"$in": pending}}, {"$unset": {"index_pending": ""}})
+        print(f"Indexed {indexed} new or revised ratings into {path}")
+    return ReviewIndex.load(path)
+
+
+if __name__ == "__main__":
+    client = MongoClient('mongodb://mymongo:27017/')
+    try:
+        build_review_index(client['RecipeHub'])
+    finally:
+        client.close()
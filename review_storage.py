@@ -0,0 +1,202 @@
+from datetime import datetime
+from typing import Any, Dict, List
+
+# How many of the newest reviews stay embedded on each recipe document
+RECENT_REVIEWS = 10
+
+SUMMARY_LENGTH = 100
+
+
+def bucket_start(date: datetime) -> datetime:
+    """Reviews are bucketed per recipe per calendar month"""
+    return datetime(date.year, date.month, 1)
+
+
+def _recent_entry(review: Dict[str, Any]) -> Dict[str, Any]:
+    text = review.get("review")
+    return {
+        "rating": review["rating"],
+        "date": review["date"],
+        "summary": text[:SUMMARY_LENGTH] if isinstance(text, str) else None
+    }
+
+
+def _bucket_entry(review: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "review_id": review["_id"],
+        "user_id": review["user_id"],
+        "date": review["date"],
+        "rating": review["rating"],
+        "review": review.get("review")
+    }
+
+
+def add_review(db, review: Dict[str, Any]) -> None:
+    """Record one already-inserted review in its bucket and the recipe's recent slice"""
+    db.review_buckets.update_one(
+        {"recipe_id": review["recipe_id"], "bucket_start": bucket_start(review["date"])},
+        {
+            "$push": {"reviews": _bucket_entry(review)},
+            "$inc": {"count": 1, "rating_sum": review["rating"]}
+        },
+        upsert=True
+    )
+    db.recipes.update_one(
+        {"_id": review["recipe_id"]},
+        {"$push": {"reviews": {
+            "$each": [_recent_entry(review)],
+            "$sort": {"date": -1},
+            "$slice": RECENT_REVIEWS
+        }}}
+    )
+
+
+def remove_review(db, review: Dict[str, Any]) -> None:
+    """Undo ``add_review`` for a stored review before it is revised"""
+    db.review_buckets.update_one(
+        {"recipe_id": review["recipe_id"], "bucket_start": bucket_start(review["date"])},
+        {
+            "$pull": {"reviews": {"review_id": review["_id"]}},
+            "$inc": {"count": -1, "rating_sum": -review["rating"]}
+        }
+    )
+    db.recipes.update_one(
+        {"_id": review["recipe_id"]},
+        {"$pull": {"reviews": {"date": review["date"], "rating": review["rating"]}}}
+    )
+
+
+def build_review_buckets(db, match: Dict[str, Any] = None) -> None:
+    """(Re)build monthly buckets from the reviews collection on the server.
+
+    ``match`` limits the rebuild to some reviews (e.g. specific recipes); the
+    affected buckets are replaced wholesale so the result is idempotent.
+    """
+    print("Building review buckets...")
+    pipeline = [{"$match": match}] if match else []
+    pipeline += [
+        {"$sort": {"date": 1}},
+        {
+            "$group": {
+                "_id": {
+                    "recipe_id": "$recipe_id",
+                    "bucket_start": {"$dateTrunc": {"date": "$date", "unit": "month"}}
+                },
+                "count": {"$sum": 1},
+                "rating_sum": {"$sum": "$rating"},
+                "reviews": {"$push": {
+                    "review_id": "$_id",
+                    "user_id": "$user_id",
+                    "date": "$date",
+                    "rating": "$rating",
+                    "review": "$review"
+                }}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "recipe_id": "$_id.recipe_id",
+                "bucket_start": "$_id.bucket_start",
+                "count": 1,
+                "rating_sum": 1,
+                "reviews": 1
+            }
+        },
+        {
+            "$merge": {
+                "into": "review_buckets",
+                "on": ["recipe_id", "bucket_start"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ]
+    # $merge on these fields requires the unique index to exist first
+    db.review_buckets.create_index([("recipe_id", 1), ("bucket_start", 1)], unique=True)
+    db.review_buckets.create_index("bucket_start")
+    db.reviews.aggregate(pipeline, allowDiskUse=True)
+
+
+def set_recent_reviews(db, match: Dict[str, Any] = None) -> None:
+    """Embed only the newest RECENT_REVIEWS reviews on each recipe"""
+    print("Embedding recent reviews on recipes...")
+    pipeline = [{"$match": match}] if match else []
+    pipeline += [
+        {
+            "$group": {
+                "_id": "$recipe_id",
+                "reviews": {"$topN": {
+                    "n": RECENT_REVIEWS,
+                    "sortBy": {"date": -1},
+                    "output": {
+                        "rating": "$rating",
+                        "date": "$date",
+                        "summary": {"$cond": [
+                            {"$eq": [{"$type": "$review"}, "string"]},
+                            {"$substrCP": ["$review", 0, SUMMARY_LENGTH]},
+                            None
+                        ]}
+                    }
+                }}
+            }
+        },
+        {"$merge": {"into": "recipes", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]
+    db.reviews.aggregate(pipeline, allowDiskUse=True)
+
+
+def bucketed_reviews(db, recipe_id) -> List[Dict[str, Any]]:
+    """Full review history of one recipe, oldest bucket first"""
+    reviews = []
+    for bucket in db.review_buckets.find({"recipe_id": recipe_id}, {"reviews": 1}).sort("bucket_start", 1):
+        reviews.extend(bucket["reviews"])
+    return reviews
+
+
+def trending_pipeline(cutoff: datetime) -> List[Dict[str, Any]]:
+    """Per-recipe recent rating stats computed from buckets overlapping the window"""
+    return [
+        {"$match": {"bucket_start": {"$gte": bucket_start(cutoff)}}},
+        {"$unwind": "$reviews"},
+        {"$match": {"reviews.date": {"$gte": cutoff}}},
+        {
+            "$group": {
+                "_id": "$recipe_id",
+                "recent_ratings": {"$avg": "$reviews.rating"},
+                "review_count": {"$sum": 1}
+            }
+        }
+    ]
+
+
+def trending_counters_pipeline(cutoff: datetime) -> List[Dict[str, Any]]:
+    """Cheaper, approximate trending stats: whole-month bucket counters, reviews never unwound"""
+    return [
+        {"$match": {"bucket_start": {"$gte": bucket_start(cutoff)}}},
+        {
+            "$group": {
+                "_id": "$recipe_id",
+                "rating_sum": {"$sum": "$rating_sum"},
+                "review_count": {"$sum": "$count"}
+            }
+        },
+        {"$addFields": {"recent_ratings": {"$divide": ["$rating_sum", "$review_count"]}}}
+    ]
+
+
+def seasonal_pipeline() -> List[Dict[str, Any]]:
+    """Per recipe/month rating stats from bucket counters, without touching individual reviews"""
+    return [
+        {
+            "$group": {
+                "_id": {
+                    "recipe": "$recipe_id",
+                    "month": {"$month": "$bucket_start"}
+                },
+                "rating_sum": {"$sum": "$rating_sum"},
+                "count": {"$sum": "$count"}
+            }
+        },
+        {"$addFields": {"avg_rating": {"$divide": ["$rating_sum", "$count"]}}}
+    ]
@@ -0,0 +1,381 @@
+import json
+import os
+import re
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_INDEX_DIR = os.environ.get("RECIPEHUB_INDEX_DIR", "indexes")
+SEARCH_INDEX_PATH = os.path.join(DEFAULT_INDEX_DIR, "search")
+
+# Integer field weights so that weighted term frequencies stay integral (uint16 postings)
+FIELD_WEIGHTS = {"name": 3, "ingredients": 2, "tags": 1, "steps": 1}
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into",
+    "is", "it", "of", "on", "or", "the", "to", "with", "until", "then", "your"
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Bumped whenever tokenize() changes; indexes saved by another version are rebuilt
+TOKENIZER_VERSION = 2
+
+
+def _stem(token: str) -> str:
+    """Very light plural folding so 'eggs' matches 'egg', and 'cookies'/'cookie' and 'berries'/'berry'
+    share the stems 'cooki' and 'berri'"""
+    if len(token) > 4 and token.endswith("ies"):
+        token = token[:-3] + "y"
+    elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    if len(token) > 3 and token.endswith("y"):
+        return token[:-1] + "i"
+    if len(token) > 3 and token.endswith("ie"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Any) -> List[str]:
+    """Lowercase, split on non-alphanumerics, drop stopwords and fold plurals"""
+    if not text:
+        return []
+    if not isinstance(text, str):
+        text = " ".join(str(t) for t in text) if isinstance(text, (list, tuple)) else str(text)
+    return [_stem(t) for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _deletes(term: str) -> List[str]:
+    return [term[:i] + term[i + 1:] for i in range(len(term))]
+
+
+def build_postings(term_count: int, term_arr: np.ndarray, doc_arr: np.ndarray,
+                   tf_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """CSR ``(offsets, docs, tfs)`` from parallel term/doc/tf arrays, docs ascending within each term"""
+    order = np.lexsort((doc_arr, term_arr))
+    counts = np.bincount(term_arr, minlength=term_count)
+    offsets = np.zeros(term_count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    tfs = np.minimum(tf_arr[order], np.iinfo(np.uint16).max).astype(np.uint16)
+    return offsets, doc_arr[order].astype(np.int32), tfs
+
+
+class _Segment:
+    """One immutable block of postings plus its per-document arrays.
+
+    Postings are stored CSR style: ``offsets[t]:offsets[t + 1]`` slices ``docs``
+    and ``tfs`` for term ``t``. Only ``live`` (the tombstone mask) is mutable.
+    """
+
+    def __init__(self, terms: List[str], offsets, docs, tfs, doc_len, original_ids, ratings, live=None):
+        self.terms = terms
+        self.term_ids = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.original_ids = original_ids
+        self.ratings = ratings
+        self.live = np.ones(len(original_ids), dtype=bool) if live is None else np.array(live, dtype=bool)
+
+    @property
+    def size(self) -> int:
+        return len(self.original_ids)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        idx = self.term_ids.get(term)
+        if idx is None:
+            return None, None
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def df(self, term: str) -> int:
+        idx = self.term_ids.get(term)
+        if idx is None:
+            return 0
+        return int(self.offsets[idx + 1] - self.offsets[idx])
+
+    @classmethod
+    def from_documents(cls, recipes: Iterable[Dict[str, Any]]) -> "_Segment":
+        vocab: Dict[str, int] = {}
+        term_chunks, tf_chunks, doc_chunks = [], [], []
+        doc_len, original_ids, ratings = [], [], []
+
+        for doc_idx, recipe in enumerate(recipes):
+            counts: Dict[int, int] = {}
+            length = 0
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(recipe.get(field)):
+                    term_id = vocab.setdefault(token, len(vocab))
+                    counts[term_id] = counts.get(term_id, 0) + weight
+                    length += weight
+            term_chunks.append(np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)))
+            tf_chunks.append(np.fromiter(counts.values(), dtype=np.int32, count=len(counts)))
+            doc_chunks.append(np.full(len(counts), doc_idx, dtype=np.int32))
+            doc_len.append(length)
+            original_ids.append(int(recipe.get("original_id", -1)))
+            rating = recipe.get("avg_rating")
+            ratings.append(float(rating) if rating is not None else np.nan)
+
+        # Re-number terms in sorted order so the vocabulary file is deterministic
+        terms = sorted(vocab)
+        remap = np.empty(len(vocab), dtype=np.int32)
+        for new_id, term in enumerate(terms):
+            remap[vocab[term]] = new_id
+
+        empty = np.empty(0, dtype=np.int32)
+        term_arr = remap[np.concatenate(term_chunks)] if term_chunks else empty
+        tf_arr = np.concatenate(tf_chunks) if tf_chunks else empty
+        doc_arr = np.concatenate(doc_chunks) if doc_chunks else empty
+        return cls._from_triples(terms, term_arr, doc_arr, tf_arr,
+                                 np.asarray(doc_len, dtype=np.int32),
+                                 np.asarray(original_ids, dtype=np.int64),
+                                 np.asarray(ratings, dtype=np.float32))
+
+    @classmethod
+    def _from_triples(cls, terms, term_arr, doc_arr, tf_arr, doc_len, original_ids, ratings) -> "_Segment":
+        offsets, docs, tfs = build_postings(len(terms), term_arr, doc_arr, tf_arr)
+        return cls(terms, offsets, docs, tfs, doc_len, original_ids, ratings)
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "terms.json"), "w") as f:
+            json.dump(self.terms, f)
+        for name in ("offsets", "docs", "tfs", "doc_len", "original_ids", "ratings", "live"):
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(getattr(self, name)))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "_Segment":
+        mode = "r" if mmap else None
+        with open(os.path.join(path, "terms.json")) as f:
+            terms = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+                  for name in ("offsets", "docs", "tfs", "doc_len", "original_ids", "ratings")}
+        live = np.load(os.path.join(path, "live.npy"))
+        return cls(terms, live=live, **arrays)
+
+
+class SearchIndex:
+    """In-process BM25 index over recipe name, ingredients, tags and steps.
+
+    The index is a list of segments: the bulk-built base segment and small delta
+    segments appended by ``update_documents``. Replaced or removed recipes are
+    tombstoned in the segment that holds them; ``compact`` merges everything back
+    into a single segment without needing the source documents.
+    """
+
+    def __init__(self, segments: Optional[List[_Segment]] = None, k1: float = 1.2, b: float = 0.75):
+        self.segments = segments or []
+        self.k1 = k1
+        self.b = b
+        self._fuzzy_map = None
+        self._refresh_stats()
+
+    def _refresh_stats(self) -> None:
+        live_lengths = [seg.doc_len[seg.live] for seg in self.segments]
+        self.doc_count = int(sum(len(l) for l in live_lengths))
+        total = sum(float(l.sum()) for l in live_lengths)
+        self.avg_doc_len = total / self.doc_count if self.doc_count else 1.0
+        ratings = np.concatenate([seg.ratings[seg.live] for seg in self.segments]) if self.segments else np.empty(0)
+        ratings = ratings[~np.isnan(ratings)]
+        self.mean_rating = float(ratings.mean()) if len(ratings) else 0.0
+        self._fuzzy_map = None
+
+    @classmethod
+    def build(cls, recipes: Iterable[Dict[str, Any]], **kwargs) -> "SearchIndex":
+        return cls([_Segment.from_documents(recipes)], **kwargs)
+
+    @classmethod
+    def load(cls, path: str = SEARCH_INDEX_PATH, mmap: bool = True) -> Optional["SearchIndex"]:
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("tokenizer") != TOKENIZER_VERSION:
+            return None  # tokenised differently; rebuild with data-creation.py
+        segments = [_Segment.load(os.path.join(path, name), mmap=mmap) for name in meta["segments"]]
+        return cls(segments, k1=meta.get("k1", 1.2), b=meta.get("b", 0.75))
+
+    def save(self, path: str = SEARCH_INDEX_PATH) -> None:
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        names = []
+        for i, segment in enumerate(self.segments):
+            name = f"seg_{i:03d}"
+            segment.save(os.path.join(tmp_path, name))
+            names.append(name)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"segments": names, "k1": self.k1, "b": self.b, "field_weights": FIELD_WEIGHTS,
+                       "doc_count": self.doc_count, "tokenizer": TOKENIZER_VERSION}, f)
+        # Swap directories so readers never see a half-written index
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def _expand_term(self, term: str, fuzzy: bool) -> List[Tuple[str, float]]:
+        """Return (term, weight) pairs to score for one query token"""
+        if not fuzzy or any(seg.df(term) for seg in self.segments) or len(term) < 4:
+            return [(term, 1.0)]
+        if self._fuzzy_map is None:
+            # Symmetric-delete map: every indexed term and its one-character deletions
+            fuzzy_map: Dict[str, set] = {}
+            for seg in self.segments:
+                counts = np.diff(seg.offsets)
+                for idx, t in enumerate(seg.terms):
+                    if len(t) < 4 or counts[idx] < 2:
+                        continue
+                    for variant in [t] + _deletes(t):
+                        fuzzy_map.setdefault(variant, set()).add(t)
+            self._fuzzy_map = fuzzy_map
+        candidates = set()
+        for variant in [term] + _deletes(term):
+            candidates.update(self._fuzzy_map.get(variant, ()))
+        # Prefer the most common corrections, discounted against exact matches
+        ranked = sorted(candidates, key=lambda t: -sum(seg.df(t) for seg in self.segments))[:3]
+        return [(t, 0.8) for t in ranked]
+
+    def search(self, query: str, limit: int = 5, fuzzy: bool = True,
+               rating_weight: float = 0.2) -> List[Tuple[int, float]]:
+        """Return ``(original_id, score)`` pairs for the top ``limit`` recipes.
+
+        BM25 relevance is normalised to [0, 1] across matching recipes and blended
+        with ``avg_rating / 5`` using ``rating_weight``.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self.doc_count:
+            return []
+
+        expanded: Dict[str, float] = {}
+        for token in tokens:
+            for term, weight in self._expand_term(token, fuzzy):
+                expanded[term] = max(expanded.get(term, 0.0), weight)
+
+        results = []
+        for seg in self.segments:
+            scores = np.zeros(seg.size, dtype=np.float32)
+            for term, weight in expanded.items():
+                docs, tfs = seg.postings(term)
+                if docs is None:
+                    continue
+                df = sum(s.df(term) for s in self.segments)
+                idf = np.log1p((self.doc_count - df + 0.5) / (df + 0.5))
+                tf = tfs.astype(np.float32)
+                norm = self.k1 * (1.0 - self.b + self.b * seg.doc_len[docs] / self.avg_doc_len)
+                scores[docs] += weight * idf * tf * (self.k1 + 1.0) / (tf + norm)
+            scores[~seg.live] = 0.0
+            hits = np.flatnonzero(scores)
+            if len(hits):
+                results.append((seg, hits, scores[hits]))
+
+        if not results:
+            return []
+
+        max_score = max(float(s.max()) for _, _, s in results)
+        candidates_ids, candidates_scores = [], []
+        for seg, hits, scores in results:
+            ratings = np.nan_to_num(seg.ratings[hits], nan=self.mean_rating)
+            blended = (1.0 - rating_weight) * scores / max_score + rating_weight * ratings / 5.0
+            candidates_ids.append(seg.original_ids[hits])
+            candidates_scores.append(blended)
+
+        ids = np.concatenate(candidates_ids)
+        scores = np.concatenate(candidates_scores)
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def remove_documents(self, original_ids: Iterable[int]) -> int:
+        """Tombstone every indexed copy of the given recipes"""
+        targets = np.asarray(list(original_ids), dtype=np.int64)
+        removed = 0
+        for seg in self.segments:
+            mask = np.isin(seg.original_ids, targets) & seg.live
+            removed += int(mask.sum())
+            seg.live[mask] = False
+        self._refresh_stats()
+        return removed
+
+    def update_documents(self, recipes: Iterable[Dict[str, Any]]) -> None:
+        """Index new or changed recipes as a delta segment, replacing older copies"""
+        recipes = list(recipes)
+        if not recipes:
+            return
+        self.remove_documents(r["original_id"] for r in recipes)
+        self.segments.append(_Segment.from_documents(recipes))
+        self._refresh_stats()
+
+    def compact(self) -> None:
+        """Merge all segments into one, dropping tombstoned documents"""
+        if len(self.segments) <= 1 and all(seg.live.all() for seg in self.segments):
+            return
+        terms = sorted(set().union(*(seg.terms for seg in self.segments)))
+        term_lookup = {t: i for i, t in enumerate(terms)}
+        term_parts, doc_parts, tf_parts = [], [], []
+        doc_len, original_ids, ratings = [], [], []
+        base = 0
+        for seg in self.segments:
+            new_doc = np.cumsum(seg.live) - 1 + base
+            remap = np.fromiter((term_lookup[t] for t in seg.terms), dtype=np.int32, count=len(seg.terms))
+            seg_terms = np.repeat(remap, np.diff(seg.offsets))
+            keep = seg.live[seg.docs]
+            term_parts.append(seg_terms[keep])
+            doc_parts.append(new_doc[seg.docs[keep]].astype(np.int32))
+            tf_parts.append(np.asarray(seg.tfs[keep], dtype=np.int32))
+            doc_len.append(seg.doc_len[seg.live])
+            original_ids.append(seg.original_ids[seg.live])
+            ratings.append(seg.ratings[seg.live])
+            base += int(seg.live.sum())
+        self.segments = [_Segment._from_triples(
+            terms, np.concatenate(term_parts), np.concatenate(doc_parts), np.concatenate(tf_parts),
+            np.concatenate(doc_len), np.concatenate(original_ids), np.concatenate(ratings)
+        )]
+        self._refresh_stats()
+
+
+SEARCH_PROJECTION = {"name": 1, "ingredients": 1, "tags": 1, "steps": 1,
+                     "avg_rating": 1, "original_id": 1, "_id": 0}
+
+
+def build_search_index(db, path: str = SEARCH_INDEX_PATH) -> SearchIndex:
+    """Build the full-text index from the recipes collection and persist it"""
+    print("Building full-text search index...")
+    cursor = db.recipes.find({}, SEARCH_PROJECTION, batch_size=2000)
+    index = SearchIndex.build(cursor)
+    index.save(path)
+    print(f"Indexed {index.doc_count} recipes into {path}")
+    return index
+
+
+def refresh_search_index(db, original_ids: Iterable[int], path: str = SEARCH_INDEX_PATH,
+                         compact_after: int = 8) -> Optional[SearchIndex]:
+    """Re-index only the given recipes, compacting once too many deltas pile up.
+
+    A missing index, or one saved by another tokenizer version, is rebuilt in full.
+    """
+    index = SearchIndex.load(path, mmap=False)
+    if index is None:
+        return build_search_index(db, path)
+    original_ids = list(original_ids)
+    recipes = list(db.recipes.find({"original_id": {"$in": original_ids}}, SEARCH_PROJECTION))
+    found = {r["original_id"] for r in recipes}
+    index.remove_documents(i for i in original_ids if i not in found)
+    index.update_documents(recipes)
+    if len(index.segments) > compact_after:
+        index.compact()
+    index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    client = MongoClient('mongodb://mymongo:27017/')
+    try:
+        build_search_index(client['RecipeHub'])
+    finally:
+        client.close()
@@ -0,0 +1,85 @@
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+# Profile vectors are keyed by dictionary IDs (see dictionaries.py); Mongo field
+# names must be strings, so IDs are stored as their decimal representation.
+PROFILE_FIELDS = {"ingredient_ids": "ingredients", "tag_ids": "tags"}
+
+TOP_INGREDIENTS = 50
+TOP_TAGS = 20
+
+
+def rating_weight(rating: float) -> float:
+    """Preference signal of one rating: 4-5 stars pull towards a recipe, 1-2 push away"""
+    return float(rating) - 3.0
+
+
+def top_preferences(profile: Dict[str, Any], vector: str, limit: int) -> List[Tuple[int, float]]:
+    """The user's most positively weighted (id, weight) pairs, normalised so the top weight is 1"""
+    weights = [(int(k), w) for k, w in profile.get(vector, {}).items() if w > 0]
+    weights.sort(key=lambda kw: -kw[1])
+    weights = weights[:limit]
+    if not weights:
+        return []
+    top = weights[0][1]
+    return [(k, w / top) for k, w in weights]
+
+
+def build_taste_profiles(db, batch_size: int = 2000) -> None:
+    """Materialise every user's profile from their ratings (the latest one per recipe, as rate_recipe revises)"""
+    print("Building taste profiles...")
+    recipe_vectors = {
+        r["_id"]: (r.get("ingredient_ids", []), r.get("tag_ids", []))
+        for r in db.recipes.find({}, {"ingredient_ids": 1, "tag_ids": 1}, batch_size=5000)
+    }
+
+    latest: Dict[Tuple[Any, Any], Tuple[Any, float]] = {}
+    for review in db.reviews.find({}, {"user_id": 1, "recipe_id": 1, "rating": 1, "date": 1, "_id": 0},
+                                  batch_size=10000):
+        if review["recipe_id"] not in recipe_vectors:
+            continue
+        key = (review["user_id"], review["recipe_id"])
+        seen = latest.get(key)
+        if seen is None or review["date"] >= seen[0]:
+            latest[key] = (review["date"], review["rating"])
+
+    profiles: Dict[Any, Dict[str, Any]] = {}
+    for (user_id, recipe_id), (_, rating) in latest.items():
+        profile = profiles.setdefault(user_id, {"ingredients": {}, "tags": {}, "rated": []})
+        profile["rated"].append(recipe_id)
+        weight = rating_weight(rating)
+        if weight == 0:
+            continue
+        for vector, ids in zip(("ingredients", "tags"), recipe_vectors[recipe_id]):
+            for item in ids:
+                key = str(item)
+                profile[vector][key] = profile[vector].get(key, 0.0) + weight
+
+    db.taste_profiles.drop()
+    now = datetime.now()
+    batch = []
+    for user_id, profile in profiles.items():
+        batch.append({"_id": user_id, **profile, "rating_count": len(profile["rated"]), "updated_at": now})
+        if len(batch) >= batch_size:
+            db.taste_profiles.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.taste_profiles.insert_many(batch, ordered=False)
+    print(f"Built {len(profiles)} taste profiles")
+
+
+def apply_rating(db, user_id: int, recipe: Dict[str, Any], rating: float, previous_rating: float = None) -> None:
+    """Incrementally fold one (possibly revised) rating into the user's profile"""
+    delta = rating_weight(rating) - (rating_weight(previous_rating) if previous_rating is not None else 0.0)
+    increments = {}
+    if delta:
+        for field, vector in PROFILE_FIELDS.items():
+            for item in recipe.get(field, []):
+                increments[f"{vector}.{item}"] = delta
+    if previous_rating is None:
+        increments["rating_count"] = 1
+
+    update = {"$addToSet": {"rated": recipe["_id"]}, "$set": {"updated_at": datetime.now()}}
+    if increments:
+        update["$inc"] = increments
+    db.taste_profiles.update_one({"_id": user_id}, update, upsert=True)